@@ -0,0 +1,40 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from database import Database
+
+
+class AsyncDatabase:
+    # Асинхронная обёртка над Database: каждый вызов выполняется в пуле потоков
+    # в собственной сессии и не блокирует event loop
+    def __init__(self, db=None, workers=None):
+        self.db = db or Database()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv('DB_WORKERS', 4)),
+            thread_name_prefix='db'
+        )
+        self._methods = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        method = self._methods.get(name)
+        if method is None:
+            @functools.wraps(attr)
+            async def method(*args, **kwargs):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, functools.partial(attr, *args, **kwargs))
+            self._methods[name] = method
+        return method
+
+    async def iterate(self, name, consume, *args, **kwargs):
+        # Потоковое чтение: генератор Database.<name>(*args, **kwargs) создаётся и
+        # обходится функцией consume в пуле БД, там же закрывается его сессия
+        iterator = getattr(self.db, name)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: consume(iterator(*args, **kwargs)))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
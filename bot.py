@@ -2,12 +2,21 @@ import os
 import asyncio
 from datetime import datetime
 from telethon import TelegramClient, events, Button
-from telethon.tl.functions.channels import GetFullChannelRequest, JoinChannelRequest
+from telethon.tl.functions.channels import JoinChannelRequest
 from telethon.tl.types import Channel, ChatAdminRights
 from telethon.errors import ChannelPrivateError, ChatAdminRequiredError
 from dotenv import load_dotenv
 from database import Database
+from async_database import AsyncDatabase
 from sentiment_analyzer import SentimentAnalyzer
+from comment_scoring import backfill_sentiment_async
+from inference_pool import InferencePool
+from group_monitor import GroupMonitor
+from entity_cache import EntityCache
+from comment_ingestion import CommentIngestor
+from view_refresher import ViewRefresher
+from link_rewriter import rewrite_links_async
+from link_shortener import LinkShortener
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -28,8 +37,23 @@ if not all([api_id, api_hash, bot_token]):
     exit(1)
 
 client = TelegramClient('bot_session', api_id, api_hash)
-db = Database()
+# Запросы к БД выполняются в пуле потоков, каждый в своей сессии
+db = AsyncDatabase(Database())
+# Модель здесь не загружается: для отчётов нужны только сохранённые оценки
 sentiment_analyzer = SentimentAnalyzer()
+# Инференс модели выполняется в отдельном пуле, чтобы не блокировать обработчики
+inference_pool = InferencePool()
+# Разрешённые каналы и группы (id и access_hash) хранятся в resolved_peers
+entity_cache = EntityCache(client, db)
+# Опрос участников всех групп из monitored_groups одним планировщиком
+group_monitor = GroupMonitor(client, db, entities=entity_cache)
+# Комментарии из групп обсуждений активных каналов
+comment_ingestor = CommentIngestor(client, db, inference_pool, entity_cache)
+# Просмотры постов обновляются пачками, свежие посты чаще старых
+view_refresher = ViewRefresher(client, db, entity_cache)
+# Внешний сервис сокращения ссылок (bitly или tinyurl); без LINK_SHORTENER ссылки
+# постов заменяются на отслеживаемые /track/<short_id>
+link_shortener = LinkShortener(db, webhook_url) if os.getenv('LINK_SHORTENER') else None
 
 # Создаем клавиатуру с основными командами
 main_keyboard = [
@@ -65,6 +89,7 @@ async def help_callback(event):
 📚 *Доступные команды:*
 
 /monitor <group_id> - Начать мониторинг группы
+/unmonitor <group_id> - Остановить мониторинг группы
 /post <text> - Опубликовать новость
 /stats - Показать статистику
 /analyze - Анализ настроений
@@ -83,15 +108,16 @@ async def help_callback(event):
 async def link_stats_callback(event):
     try:
         # Получаем последний пост
-        last_post = db.session.query(Post).order_by(Post.id.desc()).first()
-        if last_post:
-            stats = db.get_link_statistics(last_post.id)
+        last_post_id = await db.get_last_post_id()
+        if last_post_id:
+            stats = await db.get_link_statistics(last_post_id)
             stats_text = "📊 *Статистика переходов по ссылкам:*\n\n"
             for link in stats:
+                referrers = ', '.join(f"{r['referrer']} ({r['clicks']})" for r in link['top_referrers'])
                 stats_text += f"🔗 {link['original_url']}\n"
                 stats_text += f"👥 Всего переходов: {link['clicks']}\n"
                 stats_text += f"👤 Уникальных посетителей: {link['unique_ips']}\n"
-                stats_text += f"🌐 Источники: {', '.join(set(link['referrers']))}\n\n"
+                stats_text += f"🌐 Источники: {referrers}\n\n"
             await event.respond(stats_text, parse_mode='markdown', buttons=main_keyboard)
         else:
             await event.respond("❌ Нет доступной статистики по ссылкам", buttons=main_keyboard)
@@ -109,38 +135,38 @@ async def new_post_callback(event):
 
 @client.on(events.CallbackQuery(data=b"stats"))
 async def stats_callback(event):
-    stats = db.get_statistics()
+    stats = await db.get_statistics()
     await event.respond(f"📊 *Статистика:*\n{stats}", parse_mode='markdown', buttons=main_keyboard)
 
 @client.on(events.CallbackQuery(data=b"analyze"))
 async def analyze_callback(event):
-    comments = db.get_recent_comments()
-    analysis = sentiment_analyzer.analyze_batch(comments)
+    # Отчёт строится по уже сохранённым оценкам, модель здесь не запускается;
+    # итоги берутся из агрегатов каналов, из комментариев - только последние примеры
+    analysis = sentiment_analyzer.generate_report(await db.get_sentiment_summary())
+    if not inference_pool.ready:
+        analysis += "\n\n⏳ Модель анализа ещё загружается, новые комментарии будут оценены позже"
     await event.respond(f"😊 *Анализ настроений:*\n{analysis}", parse_mode='markdown', buttons=main_keyboard)
 
-async def monitor_group(group_id):
-    while True:
-        try:
-            channel = await client.get_entity(group_id)
-            full_channel = await client(GetFullChannelRequest(channel=channel))
-            members_count = full_channel.full_chat.participants_count
-            
-            # Сохраняем данные в БД
-            db.save_members_count(group_id, members_count, datetime.now())
-            print(f"Обновлена статистика группы {group_id}: {members_count} участников")
-            
-            await asyncio.sleep(300)  # Пауза 5 минут
-        except Exception as e:
-            print(f"Ошибка при мониторинге группы: {e}")
-            await asyncio.sleep(60)
-
 @client.on(events.NewMessage(pattern='/monitor'))
 async def monitor_handler(event):
     print(f"Получена команда /monitor от {event.sender_id}")
     try:
         group_id = event.text.split()[1]
-        await event.respond(f"🔄 Начинаю мониторинг группы {group_id}", buttons=main_keyboard)
-        asyncio.create_task(monitor_group(group_id))
+        if await group_monitor.add(group_id):
+            await event.respond(f"🔄 Начинаю мониторинг группы {group_id}", buttons=main_keyboard)
+        else:
+            await event.respond(f"ℹ️ Группа {group_id} уже под мониторингом", buttons=main_keyboard)
+    except IndexError:
+        await event.respond("❌ Пожалуйста, укажите ID группы", buttons=main_keyboard)
+
+@client.on(events.NewMessage(pattern='/unmonitor'))
+async def unmonitor_handler(event):
+    try:
+        group_id = event.text.split()[1]
+        if await group_monitor.remove(group_id):
+            await event.respond(f"⏹ Мониторинг группы {group_id} остановлен", buttons=main_keyboard)
+        else:
+            await event.respond(f"❌ Группа {group_id} не под мониторингом", buttons=main_keyboard)
     except IndexError:
         await event.respond("❌ Пожалуйста, укажите ID группы", buttons=main_keyboard)
 
@@ -149,18 +175,13 @@ async def post_handler(event):
     print(f"Получена команда /post от {event.sender_id}")
     try:
         text = event.text.split(maxsplit=1)[1]
-        # Находим все ссылки в тексте
-        links = [word for word in text.split() if word.startswith('http')]
-        
+
         # Сохраняем пост в БД
-        post_id = db.save_post(text, datetime.now())
-        
-        # Создаем короткие ссылки для каждой найденной ссылки
-        for link in links:
-            short_id = db.create_short_link(post_id, link)
-            short_url = f"{webhook_url}/track/{short_id}"
-            text = text.replace(link, short_url)
-        
+        post_id = await db.save_post(text, datetime.now())
+
+        # Заменяем все ссылки на короткие или отслеживаемые, ссылки создаются одной транзакцией
+        text, _ = await rewrite_links_async(db, post_id, text, webhook_url, link_shortener)
+
         await event.respond(f"✅ Пост опубликован!\nID: {post_id}\n\n{text}", buttons=main_keyboard)
     except IndexError:
         await event.respond("❌ Пожалуйста, укажите текст поста", buttons=main_keyboard)
@@ -168,19 +189,22 @@ async def post_handler(event):
 @client.on(events.NewMessage(pattern='/stats'))
 async def stats_handler(event):
     print(f"Получена команда /stats от {event.sender_id}")
-    stats = db.get_statistics()
+    stats = await db.get_statistics()
     await event.respond(f"📊 *Статистика:*\n{stats}", parse_mode='markdown', buttons=main_keyboard)
 
 @client.on(events.NewMessage(pattern='/analyze'))
 async def analyze_handler(event):
     print(f"Получена команда /analyze от {event.sender_id}")
-    comments = db.get_recent_comments()
-    analysis = sentiment_analyzer.analyze_batch(comments)
+    # Отчёт строится по уже сохранённым оценкам, модель здесь не запускается;
+    # итоги берутся из агрегатов каналов, из комментариев - только последние примеры
+    analysis = sentiment_analyzer.generate_report(await db.get_sentiment_summary())
+    if not inference_pool.ready:
+        analysis += "\n\n⏳ Модель анализа ещё загружается, новые комментарии будут оценены позже"
     await event.respond(f"😊 *Анализ настроений:*\n{analysis}", parse_mode='markdown', buttons=main_keyboard)
 
 @client.on(events.CallbackQuery(data=b"channels"))
 async def channels_callback(event):
-    channels = db.get_active_channels()
+    channels = await db.get_active_channels()
     if not channels:
         await event.respond("❌ Нет активных каналов", buttons=main_keyboard)
         return
@@ -231,11 +255,15 @@ async def add_channel_handler(event):
             return
 
         # Добавляем канал в базу данных
-        db.add_channel(
+        await db.add_channel(
             channel_id=str(channel.id),
             title=channel.title,
             username=channel_username
         )
+        # Публикации в канал не будут повторно разрешать его username
+        await entity_cache.remember(channel.id, channel)
+        # Начинаем собирать комментарии из группы обсуждения нового канала
+        await comment_ingestor.refresh_channels()
 
         await event.respond(
             f"✅ Канал {channel.title} успешно добавлен!",
@@ -250,7 +278,7 @@ async def add_channel_handler(event):
 
 @client.on(events.CallbackQuery(data=b"channel_stats"))
 async def channel_stats_callback(event):
-    channels = db.get_active_channels()
+    channels = await db.get_active_channels()
     if not channels:
         await event.respond("❌ Нет активных каналов", buttons=main_keyboard)
         return
@@ -265,7 +293,7 @@ async def channel_stats_callback(event):
 @client.on(events.CallbackQuery(pattern=b"stats_"))
 async def show_channel_stats(event):
     channel_id = event.data.decode().split('_')[1]
-    stats = db.get_channel_statistics(channel_id)
+    stats = await db.get_channel_statistics(channel_id)
     
     if not stats:
         await event.respond("❌ Статистика недоступна", buttons=main_keyboard)
@@ -311,7 +339,7 @@ async def show_channel_stats(event):
 async def show_channel_stats_period(event):
     try:
         period, channel_id = event.data.decode().split('_')[1:]
-        stats = db.get_channel_statistics(channel_id, days=int(period))
+        stats = await db.get_channel_statistics(channel_id, days=int(period))
         await show_channel_stats(event)
     except Exception as e:
         print(f"Ошибка при получении статистики: {e}")
@@ -320,7 +348,7 @@ async def show_channel_stats_period(event):
 @client.on(events.CallbackQuery(pattern=b"link_stats_"))
 async def show_channel_link_stats(event):
     channel_id = event.data.decode().split('_')[2]
-    stats = db.get_channel_link_statistics(channel_id)
+    stats = await db.get_channel_link_statistics(channel_id)
     
     if not stats:
         await event.respond("❌ Статистика ссылок недоступна", buttons=main_keyboard)
@@ -352,7 +380,7 @@ async def show_channel_link_stats(event):
 
 @client.on(events.CallbackQuery(data=b"post_to_channel"))
 async def post_to_channel_callback(event):
-    channels = db.get_active_channels()
+    channels = await db.get_active_channels()
     if not channels:
         await event.respond("❌ Нет активных каналов", buttons=main_keyboard)
         return
@@ -382,30 +410,32 @@ async def post_to_channel_handler(event):
             return
 
         text = text_parts[0]
-        channel = db.get_channel(channel_id)
+        channel = await db.get_channel(channel_id)
         if not channel:
             await event.respond("❌ Канал не найден", buttons=main_keyboard)
             return
 
-        # Находим все ссылки в тексте
-        links = [word for word in text.split() if word.startswith('http')]
-        
-        # Создаем короткие ссылки для каждой найденной ссылки
-        for link in links:
-            short_id = db.create_short_link(None, link)
-            short_url = f"{webhook_url}/track/{short_id}"
-            text = text.replace(link, short_url)
-
-        # Публикуем пост в канал
-        message = await client.send_message(channel.username, text)
-        
-        # Сохраняем пост в базу данных
-        post_id = db.save_post(
+        # Пост сохраняется до публикации, чтобы ссылки сразу были привязаны к нему
+        post_id = await db.save_post(
             text=text,
             timestamp=datetime.now(),
-            channel_id=channel.id,
-            message_id=message.id
+            channel_id=channel.id
         )
+        try:
+            text, _ = await rewrite_links_async(db, post_id, text, webhook_url, link_shortener)
+            # Публикуем пост в канал по сохранённому id и access_hash
+            peer = await entity_cache.get_input_peer(channel.channel_id, channel.username)
+            try:
+                message = await client.send_message(peer, text)
+            except ChannelPrivateError:
+                await entity_cache.invalidate(channel.channel_id)
+                raise
+        except Exception:
+            # Пост не опубликован: удаляем его вместе со ссылками
+            await db.delete_post(post_id)
+            raise
+
+        await db.set_post_message(post_id, message.id, text)
 
         await event.respond(
             f"✅ Пост успешно опубликован в канал {channel.title}!",
@@ -422,12 +452,62 @@ async def post_to_channel_handler(event):
 async def back_to_main_callback(event):
     await event.respond("Главное меню:", buttons=main_keyboard)
 
+async def score_comments_periodically():
+    # Фоновая оценка новых комментариев: каждый комментарий оценивается один раз
+    interval = int(os.getenv('SENTIMENT_BACKFILL_INTERVAL', 60))
+    while True:
+        try:
+            scored = await backfill_sentiment_async(db, inference_pool)
+            if scored:
+                cascade = inference_pool.stats()['cascade']
+                skipped = f", без инференса: {cascade['skipped_inference']:.0%}" if cascade else ""
+                print(f"Оценено новых комментариев: {scored}{skipped}")
+        except Exception as e:
+            print(f"Ошибка при оценке комментариев: {e}")
+        await asyncio.sleep(interval)
+
+async def compact_rollups_periodically():
+    # Фоновое сжатие агрегатов: устаревшие почасовые интервалы удаляются,
+    # замеры числа участников прореживаются по политике хранения
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            removed = await db.compact_rollups()
+            print(f"Сжатие агрегатов: удалено {removed} почасовых строк")
+            downsampled = await db.downsample_group_stats()
+            print(f"Прореживание замеров групп: {downsampled}")
+            memory = await db.get_memory_stats()
+            if memory:
+                largest = max(memory['operations'].items(), key=lambda item: item[1]['identity_map_max'], default=None)
+                if largest:
+                    print(f"Память: RSS {memory['rss_mb']:.0f} МБ, максимум объектов в сессии: "
+                          f"{largest[1]['identity_map_max']} ({largest[0]})")
+        except Exception as e:
+            print(f"Ошибка при сжатии агрегатов: {e}")
+
 async def main():
     print("Запуск бота...")
     await client.start(bot_token=bot_token)
+    inference_pool.start()
+    group_monitor.start()
+    comment_ingestor.start()
+    view_refresher.start()
+    # Модель загружается в фоне, бот отвечает на команды сразу
+    asyncio.create_task(inference_pool.warm_up())
+    asyncio.create_task(compact_rollups_periodically())
+    asyncio.create_task(score_comments_periodically())
     print("Бот успешно запущен!")
     print("Используйте Ctrl+C для остановки")
-    await client.run_until_disconnected()
+    try:
+        await client.run_until_disconnected()
+    finally:
+        await group_monitor.close()
+        await comment_ingestor.close()
+        await view_refresher.close()
+        if link_shortener is not None:
+            await link_shortener.close()
+        await inference_pool.close()
+        db.close()
 
 if __name__ == '__main__':
     try:
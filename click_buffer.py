@@ -0,0 +1,211 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+
+class ClickBuffer:
+    def __init__(self, db, max_size=10000, batch_size=500, flush_interval=1.0, max_attempts=5,
+                 dead_letter_path='click_dead_letter.jsonl'):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Сколько раз пробовать записать пачку, прежде чем отложить её в файл
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        self.queue = queue.Queue(maxsize=max_size)
+
+        self._flush_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # Пачка, которую не удалось записать: повторяем её при следующем сбросе
+        self._retry = []
+        self._attempts = 0
+        self._stats = {
+            'enqueued': 0,
+            'flushed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'dropped': 0,
+            'dead_lettered': 0,
+            'max_queue_depth': 0,
+            'last_flush_size': 0,
+            'last_flush_seconds': 0.0,
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='click-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def add(self, click):
+        # Время клика фиксируем в момент перехода, а не в момент записи в БД.
+        # Обработчик запроса никогда не ждёт базу: при переполненной очереди
+        # клик отбрасывается и учитывается в счётчике dropped
+        click.setdefault('click_time', datetime.now())
+        try:
+            self.queue.put_nowait(click)
+        except queue.Full:
+            self._bump('dropped')
+            return False
+
+        depth = self.queue.qsize()
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            if depth > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = depth
+        if depth >= self.batch_size:
+            # Набралась полная пачка: будим writer, не дожидаясь таймера
+            self._wake.set()
+        return True
+
+    def flush(self):
+        with self._flush_lock:
+            total = 0
+            while True:
+                batch = self._retry or self._drain(self.batch_size)
+                self._retry = []
+                if not batch:
+                    return total
+                if not self._write(batch):
+                    self._attempts += 1
+                    if self._attempts >= self.max_attempts:
+                        # Пачка не записывается (например, из-за некорректной строки):
+                        # откладываем её в файл, чтобы она не задерживала следующие клики
+                        self._dead_letter(batch)
+                        self._attempts = 0
+                        continue
+                    self._retry = batch
+                    return total
+                self._attempts = 0
+                total += len(batch)
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 5)
+            self._thread = None
+        # Дописываем всё, что осталось в очереди на момент остановки; пачки, которые
+        # так и не записались (например, база занята другим процессом), попадают в файл
+        total = 0
+        while True:
+            total += self.flush()
+            if not self._retry and self.queue.empty():
+                return total
+            time.sleep(self.flush_interval)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['queue_capacity'] = self.queue.maxsize
+        stats['queue_fill'] = stats['queue_depth'] / self.queue.maxsize if self.queue.maxsize else 0.0
+        stats['pending_retry'] = len(self._retry)
+        stats['retry_attempts'] = self._attempts
+        return stats
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Ошибка при записи кликов: {e}")
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            self.db.record_link_clicks(batch)
+        except Exception as e:
+            print(f"Ошибка при записи пачки кликов ({len(batch)} шт.): {e}")
+            self._bump('flush_errors')
+            return False
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats['flushed'] += len(batch)
+            self._stats['flushes'] += 1
+            self._stats['last_flush_size'] = len(batch)
+            self._stats['last_flush_seconds'] = elapsed
+        return True
+
+    def _dead_letter(self, batch):
+        try:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                for click in batch:
+                    # Время в ISO-формате: replay_dead_letter читает его обратно
+                    if isinstance(click.get('click_time'), datetime):
+                        click = dict(click, click_time=click['click_time'].isoformat())
+                    f.write(json.dumps(click, default=str, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"Не удалось сохранить пачку кликов в {self.dead_letter_path}: {e}")
+        print(f"Пачка кликов ({len(batch)} шт.) не записана после {self.max_attempts} попыток "
+              f"и сохранена в {self.dead_letter_path}")
+        with self._stats_lock:
+            self._stats['dead_lettered'] += len(batch)
+
+    def _bump(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+
+def replay_dead_letter(db, path, batch_size=500):
+    # Повторная запись кликов из файла отложенных пачек. Файл сначала переименовывается,
+    # поэтому серверы, которые продолжают работать, откладывают новые пачки в новый файл.
+    # Клики, которые снова не записались, возвращаются в path. Возвращает (записано, осталось)
+    replaying = path + '.replay'
+    if not os.path.exists(replaying):
+        if not os.path.exists(path):
+            return 0, 0
+        os.replace(path, replaying)
+
+    clicks, failed = [], []
+    with open(replaying, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                click = json.loads(line)
+                click['click_time'] = datetime.fromisoformat(click['click_time'])
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Некорректная строка в {replaying}: {e}")
+                failed.append(line)
+                continue
+            clicks.append((click, line))
+
+    replayed = 0
+    for start in range(0, len(clicks), batch_size):
+        batch = clicks[start:start + batch_size]
+        try:
+            replayed += db.record_link_clicks([click for click, _ in batch])
+            continue
+        except Exception as e:
+            print(f"Ошибка при записи пачки кликов ({len(batch)} шт.), записываем по одному: {e}")
+        for click, line in batch:
+            try:
+                replayed += db.record_link_clicks([click])
+            except Exception as e:
+                print(f"Клик не записан: {e}")
+                failed.append(line)
+
+    if failed:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.writelines(line if line.endswith('\n') else line + '\n' for line in failed)
+    os.remove(replaying)
+    return replayed, len(failed)
@@ -0,0 +1,226 @@
+import asyncio
+import os
+from collections import OrderedDict
+from telethon import events, utils
+from telethon.errors import ChannelPrivateError
+from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.types import PeerChannel
+from comment_scoring import score_texts_async
+from inference_pool import InferenceBusyError
+
+
+class CommentIngestor:
+    # Сбор комментариев из групп обсуждений активных каналов. Обработчик новых
+    # сообщений только кладёт комментарий в ограниченную очередь, привязка к посту,
+    # оценка и запись выполняются микропачками в отдельной задаче
+    def __init__(self, client, db, pool=None, entities=None, queue_size=None, batch_size=None,
+                 flush_interval=None, refresh_interval=None, score_timeout=None, roots_cache_size=10000):
+        self.client = client
+        self.db = db
+        self.pool = pool
+        self.entities = entities
+        self.queue_size = queue_size or int(os.getenv('COMMENT_QUEUE_SIZE', 10000))
+        self.batch_size = batch_size or int(os.getenv('COMMENT_BATCH_SIZE', 200))
+        self.flush_interval = flush_interval or float(os.getenv('COMMENT_FLUSH_INTERVAL', 2.0))
+        self.refresh_interval = refresh_interval or int(os.getenv('COMMENT_REFRESH_INTERVAL', 600))
+        # Сколько ждать оценки пачки, прежде чем сохранить её без оценки
+        self.score_timeout = score_timeout or float(os.getenv('COMMENT_SCORE_TIMEOUT', 5.0))
+        self.roots_cache_size = roots_cache_size
+        self.queue = None
+        self._tasks = []
+        # id группы обсуждения (с префиксом -100) -> id канала в таблице channels
+        self._discussions = {}
+        # (группа, id копии поста в группе) -> message_id поста в канале или None
+        self._roots = OrderedDict()
+        self.received = 0
+        self.dropped = 0
+        self.saved = 0
+        self.scored = 0
+        self.deferred = 0
+        self.unmapped = 0
+        self.batches = 0
+
+    def start(self):
+        if not self._tasks:
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.client.add_event_handler(self._on_message, events.NewMessage())
+            self._tasks = [
+                asyncio.create_task(self._refresh_periodically()),
+                asyncio.create_task(self._consume()),
+            ]
+        return self
+
+    async def close(self):
+        self.client.remove_event_handler(self._on_message)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Дописываем комментарии, которые уже в очереди
+        batch = []
+        while self.queue is not None and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            await self._process(batch)
+
+    async def refresh_channels(self):
+        # Находит группы обсуждений активных каналов; при ошибке канал остаётся
+        # со старой группой до следующего обновления
+        previous = {channel_id: chat_id for chat_id, channel_id in self._discussions.items()}
+        discussions = {}
+        for channel in await self.db.get_active_channels():
+            try:
+                if self.entities is not None:
+                    peer = await self.entities.get_input_peer(channel.channel_id, channel.username)
+                else:
+                    peer = await self.client.get_input_entity(channel.username)
+                full_channel = await self.client(GetFullChannelRequest(channel=peer))
+            except ChannelPrivateError:
+                if self.entities is not None:
+                    await self.entities.invalidate(channel.channel_id)
+                continue
+            except Exception as e:
+                print(f"Ошибка при поиске группы обсуждения канала {channel.title}: {e}")
+                if channel.id in previous:
+                    discussions[previous[channel.id]] = channel.id
+                continue
+            linked_chat_id = full_channel.full_chat.linked_chat_id
+            if linked_chat_id:
+                discussions[utils.get_peer_id(PeerChannel(linked_chat_id))] = channel.id
+        self._discussions = discussions
+        return len(discussions)
+
+    def stats(self):
+        return {
+            'discussions': len(self._discussions),
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'received': self.received,
+            'dropped': self.dropped,
+            'saved': self.saved,
+            'scored': self.scored,
+            'deferred': self.deferred,
+            'unmapped': self.unmapped,
+            'batches': self.batches,
+        }
+
+    async def _refresh_periodically(self):
+        while True:
+            try:
+                await self.refresh_channels()
+            except Exception as e:
+                print(f"Ошибка при обновлении групп обсуждений: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def _on_message(self, event):
+        channel_id = self._discussions.get(event.chat_id)
+        if channel_id is None:
+            return
+        message = event.message
+        if message.fwd_from is not None and message.fwd_from.channel_post:
+            # Автоматическая копия поста канала: комментарии отвечают на неё
+            self._remember_root((event.chat_id, message.id), message.fwd_from.channel_post)
+            return
+        reply = message.reply_to
+        if reply is None or not message.message:
+            return
+        self.received += 1
+        try:
+            self.queue.put_nowait({
+                'chat_id': event.chat_id,
+                'channel_id': channel_id,
+                'root_id': reply.reply_to_top_id or reply.reply_to_msg_id,
+                'text': message.message,
+                'timestamp': message.date.astimezone().replace(tzinfo=None)
+            })
+        except asyncio.QueueFull:
+            # Обработчик не ждёт: при переполненной очереди комментарий теряется
+            self.dropped += 1
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._process(batch)
+            except Exception as e:
+                print(f"Ошибка при записи пачки комментариев ({len(batch)} шт.): {e}")
+
+    async def _process(self, batch):
+        # Комментарии, которые не удалось привязать к посту канала (ответы на
+        # посты до подключения бота или копия поста не найдена), не сохраняются
+        post_ids = await self._map_posts(batch)
+        mapped = [(comment, post_id) for comment, post_id in zip(batch, post_ids) if post_id is not None]
+        self.unmapped += len(batch) - len(mapped)
+        if not mapped:
+            self.batches += 1
+            return
+        batch, post_ids = [comment for comment, _ in mapped], [post_id for _, post_id in mapped]
+        texts = [comment['text'] for comment in batch]
+        scores = [None] * len(batch)
+        # Пока модель загружается или очередь инференса занята, комментарии
+        # сохраняются без оценки и оцениваются фоновой задачей бота: сбор
+        # комментариев не ждёт модель, и очередь комментариев не переполняется
+        if self.pool is not None and self.pool.ready:
+            try:
+                scores = await score_texts_async(self.db, self.pool, texts, timeout=self.score_timeout, wait=False)
+                self.scored += len(batch)
+            except (InferenceBusyError, asyncio.TimeoutError):
+                self.deferred += len(batch)
+            except Exception as e:
+                print(f"Комментарии сохранены без оценки: {e}")
+        await self.db.save_comments([
+            {
+                'post_id': post_id,
+                'text': comment['text'],
+                'sentiment_score': score,
+                'timestamp': comment['timestamp']
+            } for comment, post_id, score in zip(batch, post_ids, scores)
+        ])
+        self.saved += len(batch)
+        self.batches += 1
+
+    async def _map_posts(self, batch):
+        # Копии постов, которых ещё нет в кэше, запрашиваются одним вызовом на группу
+        missing = {}
+        for comment in batch:
+            if (comment['chat_id'], comment['root_id']) not in self._roots:
+                missing.setdefault(comment['chat_id'], set()).add(comment['root_id'])
+        for chat_id, roots in missing.items():
+            roots = sorted(roots)
+            try:
+                messages = await self.client.get_messages(chat_id, ids=roots)
+            except Exception as e:
+                print(f"Ошибка при получении постов группы обсуждения {chat_id}: {e}")
+                continue
+            for root_id, message in zip(roots, messages):
+                fwd = message.fwd_from if message is not None else None
+                self._remember_root((chat_id, root_id), fwd.channel_post if fwd is not None else None)
+
+        message_ids = {}
+        for comment in batch:
+            message_id = self._roots.get((comment['chat_id'], comment['root_id']))
+            if message_id:
+                message_ids.setdefault(comment['channel_id'], set()).add(message_id)
+        posts = {}
+        for channel_id, ids in message_ids.items():
+            for message_id, post_id in (await self.db.get_post_ids_by_message_ids(channel_id, list(ids))).items():
+                posts[(channel_id, message_id)] = post_id
+        return [
+            posts.get((comment['channel_id'], self._roots.get((comment['chat_id'], comment['root_id']))))
+            for comment in batch
+        ]
+
+    def _remember_root(self, key, message_id):
+        self._roots[key] = message_id
+        self._roots.move_to_end(key)
+        while len(self._roots) > self.roots_cache_size:
+            self._roots.popitem(last=False)
@@ -0,0 +1,74 @@
+import hashlib
+import re
+import unicodedata
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    # Одинаковые по смыслу комментарии ("+1", " +1 ", "👍") должны давать один ключ
+    text = unicodedata.normalize('NFKC', text or '')
+    return _whitespace.sub(' ', text).strip().lower()
+
+
+def text_hash(text):
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def _missing_texts(hashes, texts, scores):
+    # Тексты без сохранённой оценки, по одному на каждый хэш
+    missing = {}
+    for key, text in zip(hashes, texts):
+        if key not in scores:
+            missing.setdefault(key, text or '')
+    return missing
+
+
+def score_texts(db, analyzer, texts):
+    # Оценивает тексты, обращаясь к модели только для ещё не встречавшихся
+    hashes = [text_hash(text) for text in texts]
+    scores = db.get_cached_scores(set(hashes))
+    missing = _missing_texts(hashes, texts, scores)
+    if missing:
+        new_scores = dict(zip(missing.keys(), analyzer.analyze_texts(list(missing.values()))))
+        db.save_cached_scores(new_scores)
+        scores.update(new_scores)
+    return [scores[key] for key in hashes]
+
+
+async def score_texts_async(db, pool, texts, timeout=None, wait=True):
+    # То же для AsyncDatabase и InferencePool: ни БД, ни модель не блокируют event loop.
+    # timeout и wait передаются в InferencePool.analyze_texts
+    hashes = [text_hash(text) for text in texts]
+    scores = await db.get_cached_scores(set(hashes))
+    missing = _missing_texts(hashes, texts, scores)
+    if missing:
+        new_scores = dict(zip(missing.keys(), await pool.analyze_texts(list(missing.values()), timeout, wait)))
+        await db.save_cached_scores(new_scores)
+        scores.update(new_scores)
+    return [scores[key] for key in hashes]
+
+
+def backfill_sentiment(db, analyzer, batch_size=256):
+    # Проставляет sentiment_score всем комментариям, у которых его ещё нет
+    total = 0
+    while True:
+        comments = db.get_unscored_comments(batch_size)
+        if not comments:
+            return total
+        ids = [comment_id for comment_id, _ in comments]
+        scores = score_texts(db, analyzer, [text for _, text in comments])
+        db.set_comment_scores(dict(zip(ids, scores)))
+        total += len(comments)
+
+
+async def backfill_sentiment_async(db, pool, batch_size=256):
+    total = 0
+    while True:
+        comments = await db.get_unscored_comments(batch_size)
+        if not comments:
+            return total
+        ids = [comment_id for comment_id, _ in comments]
+        scores = await score_texts_async(db, pool, [text for _, text in comments])
+        await db.set_comment_scores(dict(zip(ids, scores)))
+        total += len(comments)
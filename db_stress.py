@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Нагрузочная проверка одновременной работы двух процессов с одной базой:
+# writer пишет клики пачками, как сервер отслеживания ссылок, а reader строит
+# отчёты, как бот. Каждая роль запускается отдельным процессом во временном
+# каталоге, рабочая seo_bot.db не затрагивается. С --database-url проверка идёт
+# на указанной (тестовой) серверной базе, а --threads нагружает пул соединений
+
+LINKS = 50
+
+
+def seed(links):
+    from database import Database
+
+    db = Database()
+    # На тестовой серверной базе канал мог остаться от прошлого запуска
+    if not db.get_channel('-100200300'):
+        db.add_channel('-100200300', 'Нагрузочный канал', 'stress')
+    channel = db.get_channel('-100200300')
+    post_id = db.save_post('Пост для нагрузочной проверки', datetime.now(), channel.id, 1)
+    return channel.channel_id, post_id, [
+        db.create_short_link(post_id, f"https://example.com/{i}") for i in range(links)
+    ]
+
+
+def _percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def role_report(role, seconds, batch_size, threads, channel_id, post_id, short_ids):
+    # Выполняет операции роли в threads потоках до истечения времени
+    # и печатает итог одной строкой JSON
+    from sqlalchemy import event
+    from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+    from database import Database
+
+    db = Database()
+    link_ids = [db.get_link_by_short_id(short_id)['link_id'] for short_id in short_ids]
+    latencies = []
+    totals = {'rows': 0, 'errors': 0, 'locked': 0, 'pool_timeouts': 0, 'max_checked_out': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def sample_checked_out(engine):
+        # Замер в момент выдачи соединения: после операции оно уже вернулось в пул
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            checked_out = engine.pool.checkedout()
+            with lock:
+                totals['max_checked_out'] = max(totals['max_checked_out'], checked_out)
+        event.listen(engine, 'checkout', on_checkout)
+
+    sample_checked_out(db.engine)
+    sample_checked_out(db.read_engine)
+
+    def work():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if role == 'writer':
+                    rows = db.record_link_clicks([
+                        {
+                            'link_id': random.choice(link_ids),
+                            'user_agent': 'stress',
+                            'ip_address': f"10.0.{random.randint(0, 255)}.{random.randint(0, 255)}",
+                            'referrer': 'Direct'
+                        } for _ in range(batch_size)
+                    ])
+                else:
+                    db.get_channel_statistics(channel_id)
+                    db.get_link_statistics(post_id)
+                    db.get_link_by_short_id(random.choice(short_ids))
+                    rows = 3
+            except PoolTimeoutError:
+                with lock:
+                    totals['pool_timeouts'] += 1
+                continue
+            except OperationalError as e:
+                with lock:
+                    totals['errors'] += 1
+                    if 'locked' in str(e):
+                        totals['locked'] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                totals['rows'] += rows
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return {
+        'role': role,
+        'ops': len(latencies),
+        **totals,
+        'ops_per_sec': len(latencies) / seconds,
+        'rows_per_sec': totals['rows'] / seconds,
+        'p50_ms': _percentile(latencies, 0.5) * 1000,
+        'p95_ms': _percentile(latencies, 0.95) * 1000,
+    }
+
+
+def run(journal_mode, seconds, batch_size, writers, readers, threads, database_url=None):
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, SQLITE_JOURNAL_MODE=journal_mode, DB_MEMORY_TRACE='0')
+        if database_url:
+            env['DATABASE_URL'] = database_url
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), env.get('PYTHONPATH')]))
+        setup = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--seed'],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        channel_id, post_id, short_ids = json.loads(setup.strip().splitlines()[-1])
+
+        processes = [
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--role', role,
+                 '--seconds', str(seconds), '--batch-size', str(batch_size), '--threads', str(threads),
+                 '--target', json.dumps([channel_id, post_id, short_ids])],
+                cwd=workdir, env=env, stdout=subprocess.PIPE, text=True
+            )
+            for role in ['writer'] * writers + ['reader'] * readers
+        ]
+        reports = []
+        for process in processes:
+            output, _ = process.communicate()
+            reports.append(json.loads(output.strip().splitlines()[-1]))
+        return reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Запись кликов и чтение отчётов из нескольких процессов одновременно")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--writers', type=int, default=1)
+    parser.add_argument('--readers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=1, help="Потоков в каждом процессе")
+    parser.add_argument('--database-url', default=None,
+                        help="Тестовая база вместо временного файла SQLite, например postgresql+psycopg2://...")
+    parser.add_argument('--journal-modes', default='WAL',
+                        help="Режимы журнала через запятую, например WAL,DELETE для сравнения")
+    parser.add_argument('--seed', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--role', choices=('writer', 'reader'), default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--target', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        print(json.dumps(seed(LINKS)))
+        sys.exit(0)
+
+    if args.role:
+        channel_id, post_id, short_ids = json.loads(args.target)
+        print(json.dumps(role_report(args.role, args.seconds, args.batch_size, args.threads, channel_id, post_id, short_ids)))
+        sys.exit(0)
+
+    journal_modes = args.journal_modes.split(',')
+    if args.database_url and not args.database_url.startswith('sqlite'):
+        # Режим журнала относится только к SQLite
+        journal_modes = ['-']
+
+    failed = False
+    print(f"{'journal':>8} {'role':>7} {'ops/sec':>9} {'rows/sec':>9} {'p50, ms':>8} {'p95, ms':>8} "
+          f"{'errors':>7} {'locked':>7} {'pool max':>9} {'pool t/o':>9}")
+    for journal_mode in journal_modes:
+        for report in run(journal_mode, args.seconds, args.batch_size, args.writers, args.readers,
+                          args.threads, args.database_url):
+            print(f"{journal_mode:>8} {report['role']:>7} {report['ops_per_sec']:>9.1f} {report['rows_per_sec']:>9.1f} "
+                  f"{report['p50_ms']:>8.1f} {report['p95_ms']:>8.1f} {report['errors']:>7} {report['locked']:>7} "
+                  f"{report['max_checked_out']:>9} {report['pool_timeouts']:>9}")
+            if journal_mode.upper() in ('WAL', '-') and (report['locked'] or report['pool_timeouts']):
+                failed = True
+    if failed:
+        print("Были ошибки \"database is locked\" или ожидание соединения из пула превысило DB_POOL_TIMEOUT")
+        sys.exit(1)
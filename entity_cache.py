@@ -0,0 +1,83 @@
+from telethon import utils
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+
+
+class EntityCache:
+    # Кэш разрешённых сущностей Telegram: в памяти процесса и в таблице resolved_peers.
+    # Ключ - channel_id из таблицы channels или id группы из /monitor
+    def __init__(self, client, db):
+        self.client = client
+        self.db = db
+        self._peers = {}
+        self.hits = 0
+        self.db_hits = 0
+        self.resolves = 0
+        self.invalidations = 0
+
+    async def get_input_peer(self, key, lookup=None):
+        # lookup - чем разрешать сущность при промахе (например, username канала),
+        # по умолчанию сам ключ
+        key = str(key)
+        peer = self._peers.get(key)
+        if peer is not None:
+            self.hits += 1
+            return peer
+
+        row = await self.db.get_resolved_peer(key)
+        if row is not None:
+            self.db_hits += 1
+            peer = _make_peer(*row)
+        else:
+            self.resolves += 1
+            peer = await self.client.get_input_entity(_lookup_value(lookup or key))
+            await self._save(key, peer)
+        self._peers[key] = peer
+        return peer
+
+    async def remember(self, key, entity):
+        # Сохраняет сущность, уже полученную через get_entity, чтобы не разрешать её повторно
+        key = str(key)
+        peer = utils.get_input_peer(entity)
+        self._peers[key] = peer
+        await self._save(key, peer)
+        return peer
+
+    async def invalidate(self, key):
+        # Вызывается при ChannelPrivateError: доступ потерян или access_hash устарел
+        key = str(key)
+        self.invalidations += 1
+        self._peers.pop(key, None)
+        await self.db.delete_resolved_peer(key)
+
+    def stats(self):
+        return {
+            'size': len(self._peers),
+            'hits': self.hits,
+            'db_hits': self.db_hits,
+            'resolves': self.resolves,
+            'invalidations': self.invalidations,
+        }
+
+    async def _save(self, key, peer):
+        if isinstance(peer, InputPeerChannel):
+            await self.db.save_resolved_peer(key, 'channel', peer.channel_id, peer.access_hash)
+        elif isinstance(peer, InputPeerChat):
+            await self.db.save_resolved_peer(key, 'chat', peer.chat_id, None)
+        elif isinstance(peer, InputPeerUser):
+            await self.db.save_resolved_peer(key, 'user', peer.user_id, peer.access_hash)
+
+
+def _make_peer(peer_type, peer_id, access_hash):
+    if peer_type == 'channel':
+        return InputPeerChannel(channel_id=peer_id, access_hash=access_hash)
+    if peer_type == 'chat':
+        return InputPeerChat(chat_id=peer_id)
+    return InputPeerUser(user_id=peer_id, access_hash=access_hash)
+
+
+def _lookup_value(value):
+    # Числовые id ("-100...") разрешаются как id, остальное - как username
+    value = str(value).strip().lstrip('@')
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return value
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from telethon.errors import ChannelPrivateError, FloodWaitError
+from telethon.tl.functions.channels import GetFullChannelRequest
+
+
+class GroupMonitor:
+    # Единый планировщик опроса числа участников групп. Список групп и расписание
+    # хранятся в monitored_groups и переживают перезапуск бота
+    def __init__(self, client, db, entities=None, concurrency=None, min_interval=None, max_interval=None, jitter=None,
+                 batch_size=None, flush_interval=None):
+        self.client = client
+        self.db = db
+        # Кэш разрешённых сущностей: без него группа разрешается при каждом опросе
+        self.entities = entities
+        self.concurrency = concurrency or int(os.getenv('MONITOR_CONCURRENCY', 5))
+        self.min_interval = min_interval or int(os.getenv('MONITOR_MIN_INTERVAL', 300))
+        self.max_interval = max_interval or int(os.getenv('MONITOR_MAX_INTERVAL', 3600))
+        self.jitter = jitter if jitter is not None else float(os.getenv('MONITOR_JITTER', 0.1))
+        self.batch_size = batch_size or int(os.getenv('MONITOR_BATCH_SIZE', 100))
+        # Результаты опросов пишутся в БД пачками не реже раза в flush_interval секунд
+        self.flush_interval = flush_interval or float(os.getenv('MONITOR_FLUSH_INTERVAL', 10))
+        self._semaphore = None
+        self._wake = None
+        self._task = None
+        # Группы, опрос которых уже запущен: повторно из расписания они не берутся
+        self._in_flight = {}
+        # Опрошенные группы, результаты которых ещё не записаны
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        # До этого момента (time.monotonic) запросы не отправляются из-за FloodWait
+        self._paused_until = 0.0
+        self.polled = 0
+        self.changed = 0
+        self.errors = 0
+        self.flood_waits = 0
+        self.flushes = 0
+
+    def start(self):
+        if self._task is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def add(self, group_id):
+        # Первый опрос сразу; False, если группа уже под мониторингом
+        added = await self.db.add_monitored_group(group_id, self.min_interval, datetime.now())
+        if added and self._wake is not None:
+            self._wake.set()
+        return added
+
+    async def remove(self, group_id):
+        return await self.db.remove_monitored_group(group_id)
+
+    async def close(self):
+        tasks = list(self._in_flight.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Дописываем уже полученные замеры
+        await self._flush()
+
+    def stats(self):
+        return {
+            'in_flight': len(self._in_flight),
+            'pending': len(self._pending),
+            'flushes': self.flushes,
+            'polled': self.polled,
+            'changed': self.changed,
+            'errors': self.errors,
+            'flood_waits': self.flood_waits,
+            'paused_seconds': max(0.0, self._paused_until - time.monotonic()),
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                    await self._flush()
+                capacity = self.batch_size - len(self._in_flight)
+                if capacity > 0:
+                    busy = self._in_flight.keys() | self._pending.keys()
+                    due = await self.db.get_due_groups(datetime.now(), capacity + len(busy))
+                    for group in [g for g in due if g.group_id not in busy][:capacity]:
+                        self._in_flight[group.group_id] = asyncio.create_task(self._poll(group))
+                # Занятые группы не учитываем, иначе планировщик просыпается каждую секунду
+                next_poll = await self.db.get_next_poll_time(self._in_flight.keys() | self._pending.keys())
+                delay = 60 if next_poll is None else (next_poll - datetime.now()).total_seconds()
+                if self._pending:
+                    delay = min(delay, self._last_flush + self.flush_interval - time.monotonic())
+            except Exception as e:
+                print(f"Ошибка планировщика мониторинга групп: {e}")
+                delay = 60
+            # Просыпаемся к ближайшему опросу, по завершении опроса или при добавлении группы
+            await self._sleep(min(max(delay, 1), 60))
+
+    async def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        polls = list(self._pending.values())
+        try:
+            await self.db.record_group_polls(polls)
+        except Exception as e:
+            # Замеры остаются в очереди и записываются при следующем сбросе
+            print(f"Ошибка при записи замеров групп ({len(polls)} шт.): {e}")
+            return
+        for poll in polls:
+            if self._pending.get(poll['group_id']) is poll:
+                del self._pending[poll['group_id']]
+        self.flushes += 1
+
+    async def _sleep(self, seconds):
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _poll(self, group):
+        try:
+            await self._poll_group(group)
+        except Exception as e:
+            print(f"Ошибка при мониторинге группы {group.group_id}: {e}")
+        finally:
+            self._in_flight.pop(group.group_id, None)
+            self._wake.set()
+
+    async def _poll_group(self, group):
+        try:
+            async with self._semaphore:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                members_count = await self._fetch_members_count(group.group_id)
+        except FloodWaitError as e:
+            # Ограничение действует на весь аккаунт: приостанавливаем все опросы
+            self.flood_waits += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + e.seconds)
+            print(f"FloodWait {e.seconds} сек при опросе группы {group.group_id}, опросы приостановлены")
+            await self.db.reschedule_group(group.group_id, datetime.now() + self._spread(e.seconds), group.failures or 0)
+            return
+        except Exception as e:
+            self.errors += 1
+            failures = (group.failures or 0) + 1
+            # Повтор через минуту, при повторных ошибках интервал удваивается
+            delay = min(self.max_interval, 60 * 2 ** (failures - 1))
+            print(f"Ошибка при мониторинге группы {group.group_id}: {e}")
+            await self.db.reschedule_group(group.group_id, datetime.now() + self._spread(delay), failures)
+            return
+
+        interval = self._next_interval(group, members_count)
+        now = datetime.now()
+        self._pending[group.group_id] = {
+            'group_id': group.group_id,
+            'members_count': members_count,
+            'timestamp': now,
+            'interval': interval,
+            'next_poll_at': now + self._spread(interval)
+        }
+        self.polled += 1
+
+    async def _fetch_members_count(self, group_id):
+        if self.entities is None:
+            channel = await self.client.get_entity(group_id)
+            full_channel = await self.client(GetFullChannelRequest(channel=channel))
+            return full_channel.full_chat.participants_count
+        channel = await self.entities.get_input_peer(group_id)
+        try:
+            full_channel = await self.client(GetFullChannelRequest(channel=channel))
+        except ChannelPrivateError:
+            await self.entities.invalidate(group_id)
+            raise
+        return full_channel.full_chat.participants_count
+
+    def _next_interval(self, group, members_count):
+        # Число участников меняется - опрашиваем чаще, не меняется - реже
+        interval = group.interval or self.min_interval
+        if group.last_members_count is not None:
+            if members_count != group.last_members_count:
+                self.changed += 1
+                interval /= 2
+            else:
+                interval *= 1.5
+        return round(min(self.max_interval, max(self.min_interval, interval)))
+
+    def _spread(self, seconds):
+        # Случайный разброс, чтобы опросы тысяч групп не приходились на одну секунду
+        return timedelta(seconds=seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
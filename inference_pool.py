@@ -0,0 +1,178 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from sentiment_rules import SentimentCascade
+
+# Модель загружается в каждом воркере один раз, при его запуске
+_worker = threading.local()
+
+
+def _init_worker(threads):
+    import torch
+    # Ограничиваем intra-op потоки torch, чтобы воркеры не делили одни ядра
+    torch.set_num_threads(threads)
+    from sentiment_analyzer import SentimentAnalyzer
+    # Каскад правил работает в основном процессе, до постановки в очередь
+    _worker.analyzer = SentimentAnalyzer(cascade=False)
+    _worker.analyzer.warm_up()
+
+
+def _analyze_texts(texts, batch_size):
+    return _worker.analyzer.analyze_texts(texts, batch_size=batch_size)
+
+
+class InferenceBusyError(Exception):
+    pass
+
+
+class InferencePool:
+    def __init__(self, workers=None, mode=None, queue_size=None, threads_per_worker=None, batch_size=None, cascade=None):
+        self.workers = workers or int(os.getenv('SENTIMENT_WORKERS', 1))
+        self.mode = mode or os.getenv('SENTIMENT_POOL', 'process')
+        self.queue_size = queue_size or int(os.getenv('SENTIMENT_QUEUE_SIZE', 100))
+        self.threads_per_worker = threads_per_worker or int(os.getenv(
+            'SENTIMENT_THREADS_PER_WORKER',
+            max(1, (os.cpu_count() or 1) // self.workers)
+        ))
+        self.batch_size = batch_size
+        # Тривиальные тексты размечаются правилами и не попадают в очередь
+        if cascade is None:
+            cascade = os.getenv('SENTIMENT_CASCADE', '1') == '1'
+        self.cascade = SentimentCascade() if cascade else None
+        self.executor = None
+        self.queue = None
+        self._dispatchers = []
+        # Становится True, когда модель загружена хотя бы в одном воркере
+        self.ready = False
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.restarts = 0
+
+    def start(self):
+        if self.executor is not None:
+            return self
+        self.executor = self._create_executor()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        return self
+
+    def _create_executor(self):
+        # Модель загружается и прогревается в initializer каждого воркера
+        if self.mode == 'thread':
+            return ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix='sentiment',
+                initializer=_init_worker,
+                initargs=(self.threads_per_worker,)
+            )
+        # spawn: воркеры не наследуют event loop и соединения родительского процесса
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker,)
+        )
+
+    def _restart_executor(self, broken):
+        # Упавший воркер (например, по OOM) ломает весь пул: все следующие задачи
+        # получили бы BrokenExecutor. Одну поломку могут заметить несколько
+        # диспетчеров, пул пересоздаёт первый из них
+        if self.executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._create_executor()
+        self.ready = False
+        self.restarts += 1
+        print("Пул анализа настроений сломан, воркеры запущены заново")
+
+    async def analyze_texts(self, texts, timeout=None, wait=True):
+        if self.cascade is not None:
+            return await self.cascade.run_async(texts, lambda escalated: self._infer(escalated, timeout, wait))
+        return await self._infer(texts, timeout, wait)
+
+    async def _infer(self, texts, timeout=None, wait=True):
+        # Ставит тексты в очередь на инференс; при wait=False и полной очереди
+        # сразу возвращает InferenceBusyError вместо ожидания
+        if self.executor is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        if wait:
+            await self.queue.put((texts, future))
+        else:
+            try:
+                self.queue.put_nowait((texts, future))
+            except asyncio.QueueFull:
+                raise InferenceBusyError("Очередь анализа настроений переполнена")
+        # Отмена вызывающей задачи или таймаут отменяет и future: такой запрос
+        # будет пропущен, если воркер до него ещё не дошёл
+        return await asyncio.wait_for(future, timeout)
+
+    async def warm_up(self):
+        # Прогрев в фоне: воркер загружает модель на пустом запросе
+        try:
+            await self._infer([''])
+            self.ready = True
+            print("Модель анализа настроений загружена")
+        except Exception as e:
+            print(f"Ошибка при загрузке модели анализа настроений: {e}")
+
+    async def close(self):
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'ready': self.ready,
+            'threads_per_worker': self.threads_per_worker,
+            'queued': self.queue.qsize() if self.queue else 0,
+            'queue_size': self.queue_size,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'failed': self.failed,
+            'restarts': self.restarts,
+            'cascade': self.cascade.stats() if self.cascade else None,
+        }
+
+    async def _run_batch(self, texts):
+        # Пачка, на которой сломался пул, повторяется один раз на новом пуле;
+        # если пул ломается снова, ошибку получает только эта пачка
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                return await loop.run_in_executor(executor, _analyze_texts, texts, self.batch_size)
+            except BrokenExecutor:
+                self._restart_executor(executor)
+                if attempt:
+                    raise
+
+    async def _dispatch(self):
+        while True:
+            texts, future = await self.queue.get()
+            try:
+                if future.done():
+                    self.cancelled += 1
+                    continue
+                try:
+                    scores = await self._run_batch(texts)
+                except Exception as e:
+                    self.failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                self.completed += 1
+                self.ready = True
+                if not future.done():
+                    future.set_result(scores)
+            finally:
+                self.queue.task_done()
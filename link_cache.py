@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Маркер "ссылка не существует" для негативного кэширования
+MISSING = object()
+
+
+class LinkCache:
+    # Кэш процесса: изменения ссылок в других процессах видны только после
+    # истечения ttl, поэтому ttl держим коротким
+    def __init__(self, max_size=100000, ttl=300, negative_ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, short_id):
+        # Возвращает данные ссылки, MISSING для известного отсутствующего id
+        # или None, если в кэше ничего нет
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(short_id)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._data[short_id]
+                self.misses += 1
+                return None
+            self._data.move_to_end(short_id)
+            if entry[0] is MISSING:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[0]
+
+    def put(self, short_id, link_id, original_url, post_id):
+        self._store(short_id, {
+            'link_id': link_id,
+            'original_url': original_url,
+            'post_id': post_id
+        }, self.ttl)
+
+    def put_missing(self, short_id):
+        self._store(short_id, MISSING, self.negative_ttl)
+
+    def invalidate(self, short_id):
+        with self._lock:
+            self._data.pop(short_id, None)
+
+    def resolve(self, short_id, loader):
+        data = self.get(short_id)
+        if data is MISSING:
+            return None
+        if data is not None:
+            return data
+        data = loader(short_id)
+        if data is None:
+            self.put_missing(short_id)
+        else:
+            self.put(short_id, data['link_id'], data['original_url'], data['post_id'])
+        return data
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0
+            }
+
+    def _store(self, short_id, value, ttl):
+        with self._lock:
+            self._data[short_id] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(short_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
@@ -0,0 +1,72 @@
+import re
+
+# URL до первого пробела, кавычки или угловой скобки
+_url = re.compile(r'https?://[^\s<>"\']+', re.IGNORECASE)
+# Знаки препинания, которые в конце найденного URL относятся к тексту, а не к ссылке
+_trailing = '.,;:!?»…'
+_brackets = {')': '(', ']': '[', '}': '{'}
+
+
+def _trim(url):
+    # Закрывающая скобка остаётся частью URL, только если в нём есть парная открывающая
+    while url:
+        last = url[-1]
+        if last in _trailing:
+            url = url[:-1]
+        elif last in _brackets and url.count(last) > url.count(_brackets[last]):
+            url = url[:-1]
+        else:
+            break
+    return url
+
+
+def extract_urls(text):
+    # Позиции и адреса всех ссылок текста за один проход: [(начало, конец, url)]
+    spans = []
+    for match in _url.finditer(text):
+        url = _trim(match.group())
+        if '://' in url and not url.endswith('://'):
+            spans.append((match.start(), match.start() + len(url), url))
+    return spans
+
+
+def replace_urls(text, spans, replacements):
+    # Собирает текст заново за один проход: ссылки, у которых одна - префикс
+    # другой, заменяются каждая на своём месте
+    parts = []
+    position = 0
+    for start, end, url in spans:
+        parts.append(text[position:start])
+        parts.append(replacements.get(url, url))
+        position = end
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def _short_urls(short_ids, base_url):
+    return {url: f"{base_url}/track/{short_id}" for url, short_id in short_ids.items()}
+
+
+def rewrite_links(db, post_id, text, base_url):
+    # Заменяет ссылки поста на отслеживаемые; все Link создаются одной транзакцией.
+    # Возвращает новый текст и {url: short_id}
+    spans = extract_urls(text)
+    if not spans:
+        return text, {}
+    short_ids = db.create_short_links(post_id, [url for _, _, url in spans])
+    return replace_urls(text, spans, _short_urls(short_ids, base_url)), short_ids
+
+
+async def rewrite_links_async(db, post_id, text, base_url, shortener=None):
+    # То же для AsyncDatabase: запись ссылок не блокирует event loop. С shortener
+    # ссылки сокращаются внешним сервисом, short_id возвращаются только для тех,
+    # что заменены на отслеживаемые
+    spans = extract_urls(text)
+    if not spans:
+        return text, {}
+    urls = [url for _, _, url in spans]
+    if shortener is not None:
+        short_urls, short_ids = await shortener.shorten_many(urls, post_id)
+        return replace_urls(text, spans, short_urls), short_ids
+    short_ids = await db.create_short_links(post_id, urls)
+    return replace_urls(text, spans, _short_urls(short_ids, base_url)), short_ids
@@ -1,24 +1,232 @@
-import pyshorteners
+import asyncio
 import os
+import time
+from collections import OrderedDict
+import aiohttp
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+class ShortenerError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # После failure_threshold ошибок подряд сервис не вызывается reset_timeout секунд,
+    # затем пропускается один пробный запрос: успех закрывает цепь, ошибка снова открывает
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            if self._opened_at is None or self._trial:
+                self.opened += 1
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+
 class LinkShortener:
-    def __init__(self):
-        self.shortener = pyshorteners.Shortener()
-        # Можно использовать разные сервисы для сокращения ссылок
-        self.bitly_token = os.getenv('BITLY_TOKEN')
-        if self.bitly_token:
-            self.shortener = pyshorteners.Shortener(api_key=self.bitly_token)
-
-    def shorten(self, url):
-        try:
-            # Пробуем использовать Bitly, если есть токен
-            if self.bitly_token:
-                return self.shortener.bitly.short(url)
-            # Иначе используем TinyURL
-            return self.shortener.tinyurl.short(url)
-        except Exception as e:
-            print(f"Ошибка при сокращении ссылки: {e}")
-            return url  # Возвращаем оригинальную ссылку в случае ошибки 
\ No newline at end of file
+    # Асинхронное сокращение ссылок через Bitly или TinyURL. Соединения с сервисом
+    # переиспользуются, все URL поста сокращаются одновременно, готовые короткие
+    # ссылки хранятся в таблице short_urls. Если сервис не ответил вовремя или
+    # цепь разомкнута, URL получает отслеживаемую ссылку /track/<short_id>
+    def __init__(self, db, fallback_url, provider=None, token=None, api_url=None, timeout=None,
+                 batch_timeout=None, concurrency=None, failure_threshold=None, reset_timeout=None,
+                 cache_size=None):
+        self.db = db
+        self.fallback_url = fallback_url
+        self.token = token or os.getenv('BITLY_TOKEN')
+        self.provider = provider or os.getenv('LINK_SHORTENER') or ('bitly' if self.token else 'tinyurl')
+        if self.provider not in ('bitly', 'tinyurl'):
+            raise ValueError(f"Неизвестный сервис сокращения ссылок: {self.provider}")
+        # Адрес API можно заменить, например, на локальный сервис для проверки
+        default_url = 'https://api-ssl.bitly.com' if self.provider == 'bitly' else 'https://tinyurl.com'
+        self.api_url = (api_url or os.getenv('SHORTENER_API_URL') or default_url).rstrip('/')
+        self.timeout = timeout or float(os.getenv('SHORTENER_TIMEOUT', 3.0))
+        # Сколько ждать сокращения всех ссылок поста, после чего оставшиеся заменяются на /track
+        self.batch_timeout = batch_timeout or float(os.getenv('SHORTENER_BATCH_TIMEOUT', 10.0))
+        self.concurrency = concurrency or int(os.getenv('SHORTENER_CONCURRENCY', 10))
+        self.breaker = CircuitBreaker(
+            failure_threshold or int(os.getenv('SHORTENER_FAILURE_THRESHOLD', 5)),
+            reset_timeout or float(os.getenv('SHORTENER_RESET_TIMEOUT', 60))
+        )
+        self.cache_size = cache_size or int(os.getenv('SHORTENER_CACHE_SIZE', 10000))
+        self._cache = OrderedDict()
+        self._session = None
+        self._semaphore = None
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.db_hits = 0
+        self.fallbacks = 0
+
+    async def shorten(self, url, post_id=None):
+        short_urls, _ = await self.shorten_many([url], post_id)
+        return short_urls[url]
+
+    async def shorten_many(self, urls, post_id=None):
+        # Возвращает {url: короткая ссылка} и {url: short_id} для ссылок,
+        # которые заменены на отслеживаемые
+        urls = list(dict.fromkeys(urls))
+        short_urls = {}
+        for url in urls:
+            if url in self._cache:
+                self._cache.move_to_end(url)
+                short_urls[url] = self._cache[url]
+                self.cache_hits += 1
+        missing = [url for url in urls if url not in short_urls]
+        if missing:
+            cached = await self.db.get_cached_short_urls(self.provider, missing)
+            self.db_hits += len(cached)
+            for url, short_url in cached.items():
+                self._remember(url, short_url)
+            short_urls.update(cached)
+            missing = [url for url in missing if url not in cached]
+
+        # После паузы цепи сервис получает один пробный URL, остальные сразу идут на /track
+        trial = self.breaker.state == 'half-open'
+        if missing and self.breaker.allow():
+            shortened = await self._shorten_remote(missing[:1] if trial else missing)
+            if shortened:
+                await self.db.save_cached_short_urls(self.provider, shortened)
+                for url, short_url in shortened.items():
+                    self._remember(url, short_url)
+                short_urls.update(shortened)
+            missing = [url for url in missing if url not in shortened]
+
+        short_ids = {}
+        if missing:
+            self.fallbacks += len(missing)
+            short_ids = await self.db.create_short_links(post_id, missing)
+            for url, short_id in short_ids.items():
+                short_urls[url] = f"{self.fallback_url}/track/{short_id}"
+        return short_urls, short_ids
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self):
+        return {
+            'provider': self.provider,
+            'circuit': self.breaker.state,
+            'circuit_opened': self.breaker.opened,
+            'cache_size': len(self._cache),
+            'cache_hits': self.cache_hits,
+            'db_hits': self.db_hits,
+            'requests': self.requests,
+            'errors': self.errors,
+            'fallbacks': self.fallbacks,
+        }
+
+    async def _shorten_remote(self, urls):
+        tasks = {asyncio.create_task(self._shorten_one(url)): url for url in urls}
+        done, pending = await asyncio.wait(tasks, timeout=self.batch_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            print(f"Сервис сокращения ссылок не успел обработать {len(pending)} ссылок")
+        shortened = {}
+        for task in done:
+            # Непредвиденная ошибка одной ссылки не отменяет остальные: ссылка уходит на /track
+            try:
+                short_url = task.result()
+            except Exception as e:
+                self.errors += 1
+                self.breaker.record_failure()
+                print(f"Ошибка при сокращении ссылки {tasks[task]}: {e!r}")
+                continue
+            if short_url is not None:
+                shortened[tasks[task]] = short_url
+        return shortened
+
+    async def _shorten_one(self, url):
+        async with self._get_semaphore():
+            # Пока ссылки ждали очереди, цепь могла разомкнуться
+            if self.breaker.state == 'open':
+                return None
+            self.requests += 1
+            try:
+                short_url = await self._request(url)
+            except asyncio.CancelledError:
+                # Не уложились в batch_timeout: для цепи это такая же ошибка
+                self.breaker.record_failure()
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, ShortenerError) as e:
+                self.errors += 1
+                self.breaker.record_failure()
+                print(f"Ошибка при сокращении ссылки {url}: {e!r}")
+                return None
+            self.breaker.record_success()
+            return short_url
+
+    async def _request(self, url):
+        session = self._get_session()
+        if self.provider == 'bitly':
+            async with session.post(
+                f"{self.api_url}/v4/shorten",
+                json={'long_url': url},
+                headers={'Authorization': f"Bearer {self.token}"}
+            ) as response:
+                if response.status not in (200, 201):
+                    raise ShortenerError(f"HTTP {response.status}")
+                short_url = (await response.json()).get('link')
+        else:
+            async with session.get(f"{self.api_url}/api-create.php", params={'url': url}) as response:
+                if response.status != 200:
+                    raise ShortenerError(f"HTTP {response.status}")
+                short_url = (await response.text()).strip()
+        if not short_url or not short_url.startswith(('http://', 'https://')):
+            raise ShortenerError(f"Некорректный ответ сервиса: {short_url!r}")
+        return short_url
+
+    def _get_session(self):
+        # Одна сессия на процесс: соединения с сервисом остаются открытыми между постами
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def _remember(self, url, short_url):
+        self._cache[url] = short_url
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
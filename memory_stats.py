@@ -0,0 +1,42 @@
+import os
+import resource
+import threading
+
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_mb():
+    # Текущий резидентный объём памяти процесса; вне Linux - пиковый
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _page_size / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MemoryTracker:
+    # Для каждой операции с БД: размер identity map сессии и изменение RSS процесса
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operations = {}
+
+    def record(self, operation, identity_map_size, rss_before, rss_after):
+        with self._lock:
+            stats = self.operations.setdefault(operation, {
+                'calls': 0,
+                'identity_map_last': 0,
+                'identity_map_max': 0,
+                'rss_delta_mb_max': 0.0,
+                'rss_delta_mb_total': 0.0,
+            })
+            delta = rss_after - rss_before
+            stats['calls'] += 1
+            stats['identity_map_last'] = identity_map_size
+            stats['identity_map_max'] = max(stats['identity_map_max'], identity_map_size)
+            stats['rss_delta_mb_max'] = max(stats['rss_delta_mb_max'], delta)
+            stats['rss_delta_mb_total'] += delta
+
+    def snapshot(self):
+        with self._lock:
+            operations = {name: dict(stats) for name, stats in self.operations.items()}
+        return {'rss_mb': current_rss_mb(), 'operations': operations}
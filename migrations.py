@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+from datetime import datetime
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, select, insert, update, delete, inspect, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+# Служебная таблица с номерами применённых миграций
+_version_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _version_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String),
+    Column('applied_at', DateTime, default=datetime.now)
+)
+
+
+def _create_indexes(*names):
+    # Миграция, создающая индексы, описанные в моделях (__table_args__)
+    def apply(connection, metadata):
+        for table in metadata.tables.values():
+            for index in table.indexes:
+                if index.name in names:
+                    index.create(connection, checkfirst=True)
+    return apply
+
+
+def _rebuild_rollups(connection, metadata):
+    # Заполняет таблицы агрегатов по уже накопленным сырым данным
+    from database import rebuild_rollups
+    rebuild_rollups(connection)
+
+
+def _add_column(connection, metadata, table, column):
+    # create_all не добавляет новые столбцы в уже существующие таблицы;
+    # тип столбца берётся из модели для диалекта текущей базы
+    columns = {existing['name'] for existing in inspect(connection).get_columns(table)}
+    if column not in columns:
+        column_type = metadata.tables[table].c[column].type.compile(dialect=connection.dialect)
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+def _add_group_stats_resolution(connection, metadata):
+    # Разрешение замера для прореживания; существующие строки - отдельные замеры
+    _add_column(connection, metadata, 'group_stats', 'resolution')
+    group_stats = metadata.tables['group_stats']
+    connection.execute(update(group_stats).where(group_stats.c.resolution.is_(None)).values(resolution='raw'))
+    _create_indexes('ix_group_stats_group_resolution_timestamp')(connection, metadata)
+
+
+def _add_posts_views_updated_at(connection, metadata):
+    # Время последнего обновления просмотров поста из Telegram
+    _add_column(connection, metadata, 'posts', 'views_updated_at')
+
+
+def _drop_unused_rollups(connection, metadata):
+    # Агрегаты по постам никто не читает: отчёты строятся по ссылкам и каналам
+    stats_rollups = metadata.tables['stats_rollups']
+    connection.execute(delete(stats_rollups).where(stats_rollups.c.scope == 'post'))
+
+
+def _restore_sentiment_rollups(connection, metadata):
+    # Счётчики тональности в агрегатах каналов: по ним /analyze считает итоги.
+    # Базы, где миграция 5 удаляла эти столбцы, получают их заново с пересчётом
+    for column in ('positive', 'neutral', 'negative'):
+        _add_column(connection, metadata, 'stats_rollups', column)
+    _rebuild_rollups(connection, metadata)
+
+
+# Список миграций: (версия, описание, функция(connection, metadata))
+MIGRATIONS = [
+    (1, 'Индексы для статистики постов, ссылок, комментариев и групп', _create_indexes(
+        'ix_posts_channel_id_timestamp',
+        'ix_posts_message_id',
+        'ix_links_post_id',
+        'ix_link_clicks_link_id_click_time',
+        'ix_comments_timestamp',
+        'ix_group_stats_timestamp',
+    )),
+    (2, 'Агрегаты кликов, просмотров и комментариев по ссылкам, постам и каналам', _rebuild_rollups),
+    (3, 'Разрешение замеров числа участников групп для прореживания', _add_group_stats_resolution),
+    (4, 'Время обновления просмотров постов', _add_posts_views_updated_at),
+    (5, 'Удаление неиспользуемых агрегатов по постам', _drop_unused_rollups),
+    (6, 'Индексы для обслуживания агрегатов и замеров групп', _create_indexes(
+        'ix_stats_rollups_period_bucket',
+        'ix_group_stats_resolution_timestamp',
+        'ix_monitored_groups_last_polled_at',
+    )),
+    (7, 'Частичный индекс неоценённых комментариев', _create_indexes('ix_comments_unscored')),
+    (8, 'Счётчики тональности комментариев в агрегатах каналов', _restore_sentiment_rollups),
+]
+
+
+def get_schema_version(connection):
+    _version_metadata.create_all(connection)
+    version = connection.execute(
+        select(schema_migrations.c.version).order_by(schema_migrations.c.version.desc()).limit(1)
+    ).scalar()
+    return version or 0
+
+
+def run_migrations(engine, metadata):
+    # Применяет к существующей базе все миграции новее текущей версии схемы
+    applied = []
+    with engine.begin() as connection:
+        current = get_schema_version(connection)
+        for version, description, apply in MIGRATIONS:
+            if version <= current:
+                continue
+            apply(connection, metadata)
+            connection.execute(insert(schema_migrations).values(
+                version=version,
+                description=description,
+                applied_at=datetime.now()
+            ))
+            applied.append(version)
+            print(f"Применена миграция {version}: {description}")
+    return applied
+
+
+class _ExplainQueryPlan(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_ExplainQueryPlan)
+def _compile_explain_query_plan(element, compiler, **kw):
+    # Параметры запроса передаются так же, как при его обычном выполнении
+    return 'EXPLAIN QUERY PLAN ' + compiler.process(element.statement, **kw)
+
+
+def explain_query_plan(connection, statement):
+    # Строки плана SQLite (поле detail). Они читаются с курсора: типы колонок
+    # запроса к ним не относятся
+    return [row[-1] for row in connection.execute(_ExplainQueryPlan(statement)).cursor.fetchall()]
+
+
+def _plan_table(detail):
+    # Имя таблицы из строки плана: "SCAN posts ...", "SEARCH TABLE posts ..."
+    words = detail.replace('TABLE ', '').split()
+    return words[1] if len(words) > 1 else None
+
+
+def _bound_columns(detail):
+    # Колонки индекса, которые связывает поиск: "(scope=? AND scope_id=? AND bucket>?)"
+    match = re.search(r'\(([^()]*)\)\s*$', detail)
+    if not match:
+        return set()
+    return {re.match(r'\w+', part.strip()).group() for part in match.group(1).split(' AND ')}
+
+
+def check_query_plans(engine, queries):
+    # queries - {название: (select(), {таблица: колонки индекса})}, те же объекты,
+    # что выполняют методы статистики (database.plan_check_queries). Ошибка - любой
+    # просмотр таблицы (SCAN, в том числе по индексу), поиск по таблице, для которой
+    # не указаны колонки, и поиск, не связавший все указанные колонки индекса.
+    # Возвращает список (название, план, причина)
+    if engine.dialect.name != 'sqlite':
+        return []
+    failures = []
+    with engine.connect() as connection:
+        # Просмотр подзапроса (SCAN anon_1) таблицу не читает, учитываются только таблицы
+        tables = set(inspect(connection).get_table_names())
+        # Просмотр частичного индекса (CREATE INDEX ... WHERE) читает только подходящие строки
+        partial_indexes = set(connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'"
+        )).scalars())
+        for name, (statement, expected) in queries.items():
+            details = explain_query_plan(connection, statement)
+            problems = []
+            searched = set()
+            for detail in details:
+                table = _plan_table(detail)
+                if table not in tables:
+                    continue
+                index = re.search(r'USING (?:COVERING )?INDEX (\w+)', detail)
+                partial = detail.startswith('SCAN') and index is not None and index.group(1) in partial_indexes
+                if detail.startswith('SCAN') and not partial:
+                    problems.append(f"просмотр таблицы {table}")
+                elif detail.startswith('SEARCH') or partial:
+                    searched.add(table)
+                    if table not in expected:
+                        problems.append(f"поиск по {table} без ожидаемых колонок")
+                        continue
+                    missing = [column for column in expected[table] if column not in _bound_columns(detail)]
+                    if missing:
+                        problems.append(f"поиск по {table} не связывает {', '.join(missing)}")
+            for table in expected:
+                if table not in searched:
+                    problems.append(f"нет поиска по {table}")
+            if problems:
+                failures.append((name, details, problems))
+    return failures
+
+
+if __name__ == '__main__':
+    from database import Database, plan_check_queries
+
+    db = Database()
+    with db.engine.connect() as connection:
+        print(f"Версия схемы: {get_schema_version(connection)}")
+
+    if '--rebuild-rollups' in sys.argv:
+        print(f"Агрегаты пересчитаны: {db.rebuild_rollups()} строк")
+
+    if '--downsample-group-stats' in sys.argv:
+        print(f"Прореживание замеров групп: {db.downsample_group_stats()}")
+
+    if '--compact-rollups' in sys.argv:
+        print(f"Удалено устаревших почасовых агрегатов: {db.compact_rollups()}")
+
+    if '--replay-clicks' in sys.argv:
+        from click_buffer import replay_dead_letter
+        dead_letter_path = os.getenv('CLICK_DEAD_LETTER_PATH', 'click_dead_letter.jsonl')
+        replayed, failed = replay_dead_letter(db, dead_letter_path)
+        print(f"Клики из {dead_letter_path}: записано {replayed}, не записано {failed}")
+
+    if '--check-plans' in sys.argv:
+        failures = check_query_plans(db.engine, plan_check_queries())
+        for name, details, problems in failures:
+            print(f"Запрос {name}: {'; '.join(problems)}. План: {'; '.join(details)}")
+        if failures:
+            sys.exit(1)
+        print("Все запросы статистики используют индексы")
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+import aiohttp
+from aiohttp import web
+from database import Database
+from redirect_server import create_app
+
+# Проверка, что сервер переходов отдаёт в Location сохранённый адрес без
+# нормализации пути, а адрес с не-ASCII символами - закодированным, без ошибки 500
+
+CASES = (
+    ('точечные сегменты', 'https://example.com/a/../b/./c?x=1&y=%2F#frag',
+     'https://example.com/a/../b/./c?x=1&y=%2F#frag'),
+    ('не-ASCII путь и запрос', 'https://example.com/статья?q=тест',
+     'https://example.com/%D1%81%D1%82%D0%B0%D1%82%D1%8C%D1%8F?q=%D1%82%D0%B5%D1%81%D1%82'),
+    ('не-ASCII домен', 'https://пример.рф/путь',
+     'https://xn--e1afmkfd.xn--p1ai/%D0%BF%D1%83%D1%82%D1%8C'),
+)
+
+
+async def run_checks():
+    failures = []
+
+    def check(condition, message):
+        print(f"{'OK' if condition else 'Ошибка'}: {message}")
+        if not condition:
+            failures.append(message)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db = Database(url=f"sqlite:///{os.path.join(workdir, 'redirect.db')}")
+        post_id = db.save_post('Пост со ссылками', datetime.now())
+        short_ids = db.create_short_links(post_id, [original for _, original, _ in CASES])
+
+        runner = web.AppRunner(create_app(db))
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        try:
+            async with aiohttp.ClientSession() as session:
+                for name, original, expected in CASES:
+                    async with session.get(f"http://{host}:{port}/track/{short_ids[original]}",
+                                           allow_redirects=False) as response:
+                        location = response.headers.get('Location')
+                        check(response.status == 302 and location == expected,
+                              f"{name}: {response.status} {location}")
+        finally:
+            await runner.cleanup()
+        with db.read_engine.connect() as connection:
+            clicks = connection.exec_driver_sql('SELECT COUNT(*) FROM link_clicks').scalar()
+        check(clicks == len(CASES), f"записано кликов: {clicks} из {len(CASES)}")
+    return failures
+
+
+if __name__ == '__main__':
+    failures = asyncio.run(run_checks())
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+from datetime import datetime
+from urllib.parse import quote, urlsplit
+from aiohttp import web
+from dotenv import load_dotenv
+from async_database import AsyncDatabase
+from click_buffer import ClickBuffer
+from database import Database
+from link_cache import LinkCache, MISSING
+
+load_dotenv()
+
+# Асинхронный сервер переходов /track/<short_id> - замена webhook_server.py для
+# продакшена. Каждый процесс-воркер держит свои соединения с БД, кэш ссылок и
+# очередь кликов; воркеры слушают один порт через SO_REUSEPORT
+REDIRECT_WORKERS = int(os.getenv('REDIRECT_WORKERS', os.cpu_count() or 1))
+REDIRECT_KEEPALIVE = float(os.getenv('REDIRECT_KEEPALIVE', 75))
+CLICK_INGESTION = os.getenv('CLICK_INGESTION', 'buffered')
+
+
+def redirect_location(url):
+    # Адрес перехода отдаётся в том виде, в каком сохранён: путь не нормализуется
+    # (точечные сегменты, регистр и экранирование остаются). Как redirect() во
+    # webhook_server.py, домен с не-ASCII символами переводится в punycode, а
+    # остальные не-ASCII символы и пробелы кодируются процентами
+    try:
+        netloc = urlsplit(url).netloc
+    except ValueError:
+        netloc = ''
+    userinfo, at, host = netloc.rpartition('@')
+    hostname, colon, port = host.partition(':')
+    if not hostname.isascii():
+        try:
+            url = url.replace(netloc, f"{userinfo}{at}{hostname.encode('idna').decode('ascii')}{colon}{port}", 1)
+        except UnicodeError:
+            pass
+    return quote(url, safe="%!#$&'()*+,/:;=?@[]~")
+
+
+class RedirectWorker:
+    def __init__(self, db=None):
+        self.link_cache = LinkCache(
+            max_size=int(os.getenv('LINK_CACHE_SIZE', 100000)),
+            ttl=float(os.getenv('LINK_CACHE_TTL', 300)),
+            negative_ttl=float(os.getenv('LINK_CACHE_NEGATIVE_TTL', 60))
+        )
+        self.db = AsyncDatabase(db or Database())
+        self.click_buffer = None
+        if CLICK_INGESTION == 'buffered':
+            self.click_buffer = ClickBuffer(
+                self.db.db,
+                max_size=int(os.getenv('CLICK_QUEUE_SIZE', 10000)),
+                batch_size=int(os.getenv('CLICK_BATCH_SIZE', 500)),
+                flush_interval=float(os.getenv('CLICK_FLUSH_INTERVAL', 1.0)),
+                max_attempts=int(os.getenv('CLICK_FLUSH_ATTEMPTS', 5)),
+                dead_letter_path=os.getenv('CLICK_DEAD_LETTER_PATH', 'click_dead_letter.jsonl')
+            ).start()
+
+    async def track(self, request):
+        try:
+            # Получаем информацию о клике
+            user_agent = request.headers.get('User-Agent', 'Unknown')
+            ip_address = request.remote
+            referrer = request.headers.get('Referer', 'Direct')
+
+            link_data = await self.resolve(request.match_info['short_id'])
+            if not link_data:
+                return web.Response(text="Link not found", status=404)
+
+            click = {
+                'link_id': link_data['link_id'],
+                'user_agent': user_agent,
+                'ip_address': ip_address,
+                'referrer': referrer,
+                'click_time': datetime.now()
+            }
+            if self.click_buffer is None:
+                await self.db.record_link_clicks([click])
+            else:
+                self.click_buffer.add(click)
+
+            return web.Response(status=302, headers={'Location': redirect_location(link_data['original_url'])})
+        except Exception as e:
+            print(f"Ошибка при обработке клика: {e}")
+            return web.Response(text="Error", status=500)
+
+    async def resolve(self, short_id):
+        # Попадание в кэш обслуживается без обращения к пулу потоков БД
+        data = self.link_cache.get(short_id)
+        if data is MISSING:
+            return None
+        if data is not None:
+            return data
+        data = await self.db.get_link_by_short_id(short_id)
+        if data is None:
+            self.link_cache.put_missing(short_id)
+        else:
+            self.link_cache.put(short_id, data['link_id'], data['original_url'], data['post_id'])
+        return data
+
+    async def click_metrics(self, request):
+        if not self.click_buffer:
+            return web.json_response({'worker': os.getpid(), 'mode': CLICK_INGESTION})
+        return web.json_response({'worker': os.getpid(), 'mode': CLICK_INGESTION, **self.click_buffer.stats()})
+
+    async def link_cache_metrics(self, request):
+        return web.json_response({'worker': os.getpid(), **self.link_cache.stats()})
+
+    async def db_pool_metrics(self, request):
+        return web.json_response({'worker': os.getpid(), **self.db.db.get_pool_stats()})
+
+    async def memory_metrics(self, request):
+        return web.json_response({'worker': os.getpid(), 'memory': self.db.db.get_memory_stats()})
+
+    async def shutdown(self, app):
+        # Повторный SIGTERM (от родителя и от systemd одновременно) не должен
+        # прерывать запись очереди кликов
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+            signal.signal(signum, signal.SIG_IGN)
+
+    async def close(self, app):
+        # Дописываем очередь кликов в БД при остановке воркера: если база занята
+        # другим воркером, close повторяет запись и в итоге сохраняет клики в файл
+        loop = asyncio.get_running_loop()
+        if self.click_buffer is not None:
+            await loop.run_in_executor(None, self.click_buffer.close)
+        await loop.run_in_executor(None, self.db.close)
+
+
+def create_app(db=None):
+    # Вызывается в процессе воркера: соединения с БД не наследуются от родителя
+    worker = RedirectWorker(db)
+    app = web.Application()
+    app.router.add_get('/track/{short_id}', worker.track)
+    app.router.add_get('/metrics/clicks', worker.click_metrics)
+    app.router.add_get('/metrics/links', worker.link_cache_metrics)
+    app.router.add_get('/metrics/db', worker.db_pool_metrics)
+    app.router.add_get('/metrics/memory', worker.memory_metrics)
+    app.on_shutdown.append(worker.shutdown)
+    app.on_cleanup.append(worker.close)
+    return app
+
+
+def run_worker(host, port, reuse_port):
+    # SIGINT и SIGTERM останавливают воркер штатно, очередь кликов дописывается
+    web.run_app(
+        create_app(), host=host, port=port, reuse_port=reuse_port,
+        keepalive_timeout=REDIRECT_KEEPALIVE, access_log=None, print=None
+    )
+
+
+def serve(host, port, workers):
+    if workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        print("SO_REUSEPORT не поддерживается, запускается один воркер")
+        workers = 1
+    # Схема создаётся и мигрирует один раз до запуска воркеров
+    db = Database()
+    db.engine.dispose()
+    db.read_engine.dispose()
+    print(f"Сервер переходов: http://{host}:{port}, воркеров: {workers}")
+    if workers == 1:
+        run_worker(host, port, False)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(host, port, True), name=f'redirect-{i}')
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # SIGINT от терминала получают и воркеры: ждём, пока они допишут клики
+        for process in processes:
+            process.join()
+    for process in processes:
+        if process.exitcode:
+            print(f"Воркер {process.name} завершился с кодом {process.exitcode}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Асинхронный сервер переходов по отслеживаемым ссылкам')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.getenv('WEBHOOK_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=REDIRECT_WORKERS, help='число процессов-воркеров')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
@@ -1,41 +1,143 @@
-from transformers import pipeline
-import torch
 import os
+import threading
 from dotenv import load_dotenv
+from sentiment_rules import SentimentCascade
 
 load_dotenv()
 
+MODEL_NAME = "blanchefort/rubert-base-cased-sentiment"
+
+# Доступные бэкенды инференса: pytorch - исходная fp32 модель,
+# quantized - динамическая int8-квантизация линейных слоёв (только CPU),
+# onnx - граф ONNX Runtime (нужен пакет optimum[onnxruntime])
+BACKENDS = ('pytorch', 'quantized', 'onnx')
+
 class SentimentAnalyzer:
-    def __init__(self):
+    def __init__(self, batch_size=None, backend=None, cascade=None):
+        # Модель загружается лениво, при первом использовании или в warm_up():
+        # transformers и torch не импортируются при старте бота
+        self._analyzer = None
+        self._load_lock = threading.Lock()
+        self.batch_size = batch_size or int(os.getenv('SENTIMENT_BATCH_SIZE', 32))
+        self.backend = backend or os.getenv('SENTIMENT_BACKEND', 'pytorch')
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд анализа настроений: {self.backend}")
+        self.max_length = 512
+        # Каскад правил перед моделью: тривиальные тексты размечаются без инференса
+        if cascade is None:
+            cascade = os.getenv('SENTIMENT_CASCADE', '1') == '1'
+        self.cascade = SentimentCascade() if cascade else None
+
+    @property
+    def is_ready(self):
+        return self._analyzer is not None
+
+    @property
+    def analyzer(self):
+        if self._analyzer is None:
+            self.warm_up()
+        return self._analyzer
+
+    def warm_up(self):
+        with self._load_lock:
+            if self._analyzer is not None:
+                return
+            analyzer = self._load_pipeline()
+            # Длинные тексты обрезаются до максимальной длины входа модели
+            self.max_length = min(analyzer.tokenizer.model_max_length, 512)
+            self._analyzer = analyzer
+
+    def _load_pipeline(self):
+        from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
+        import torch
+
+        token = os.getenv('HUGGINGFACE_TOKEN')
+        if self.backend == 'onnx':
+            try:
+                return self._load_onnx_pipeline(token)
+            except ImportError as e:
+                print(f"ONNX Runtime недоступен ({e}), используется бэкенд pytorch")
+                self.backend = 'pytorch'
+
+        if self.backend == 'quantized':
+            # Динамическая квантизация: веса линейных слоёв в int8, активации
+            # квантуются на лету. Работает только на CPU
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, token=token)
+            model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, token=token)
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            return pipeline("sentiment-analysis", model=model, tokenizer=tokenizer, device=-1)
+
         # Загружаем предобученную модель для анализа настроений
-        self.analyzer = pipeline(
+        return pipeline(
             "sentiment-analysis",
-            model="blanchefort/rubert-base-cased-sentiment",
-            token=os.getenv('HUGGINGFACE_TOKEN'),
+            model=MODEL_NAME,
+            token=token,
             device=0 if torch.cuda.is_available() else -1
         )
 
+    def _load_onnx_pipeline(self, token):
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import pipeline, AutoTokenizer
+
+        # Экспортированный граф сохраняется на диск, чтобы не экспортировать модель при каждом запуске
+        onnx_path = os.getenv('SENTIMENT_ONNX_PATH', 'models/rubert-sentiment-onnx')
+        if os.path.isdir(onnx_path):
+            model = ORTModelForSequenceClassification.from_pretrained(onnx_path)
+            tokenizer = AutoTokenizer.from_pretrained(onnx_path)
+        else:
+            model = ORTModelForSequenceClassification.from_pretrained(MODEL_NAME, export=True, token=token)
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, token=token)
+            model.save_pretrained(onnx_path)
+            tokenizer.save_pretrained(onnx_path)
+        return pipeline("sentiment-analysis", model=model, tokenizer=tokenizer)
+
+    @staticmethod
+    def _to_score(result):
+        # Преобразуем метку в числовой score
+        if result['label'] == 'POSITIVE':
+            return result['score']
+        elif result['label'] == 'NEUTRAL':
+            return 0.0
+        return -result['score']
+
     def analyze_text(self, text):
         try:
-            result = self.analyzer(text)[0]
-            # Преобразуем метку в числовой score
-            if result['label'] == 'POSITIVE':
-                score = result['score']
-            elif result['label'] == 'NEUTRAL':
-                score = 0.0
-            else:
-                score = -result['score']
-            return score
+            result = self.analyzer(text, truncation=True, max_length=self.max_length)[0]
+            return self._to_score(result)
         except Exception as e:
             print(f"Ошибка при анализе текста: {e}")
             return 0.0
 
+    def analyze_texts(self, texts, batch_size=None):
+        if self.cascade is not None:
+            return self.cascade.run(texts, lambda escalated: self._infer_texts(escalated, batch_size))
+        return self._infer_texts(texts, batch_size)
+
+    def _infer_texts(self, texts, batch_size=None):
+        # Пакетный инференс: тексты сортируются по длине, чтобы в одном батче
+        # оказывались близкие по длине тексты и паддинга было меньше
+        batch_size = batch_size or self.batch_size
+        scores = [0.0] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            chunk = order[start:start + batch_size]
+            batch = [texts[i] for i in chunk]
+            try:
+                results = self.analyzer(batch, batch_size=len(batch), truncation=True, max_length=self.max_length)
+                for i, result in zip(chunk, results):
+                    scores[i] = self._to_score(result)
+            except Exception as e:
+                print(f"Ошибка при пакетном анализе, анализируем по одному: {e}")
+                for i, text in zip(chunk, batch):
+                    scores[i] = self.analyze_text(text)
+        return scores
+
     def analyze_batch(self, comments):
+        texts = [comment.text for comment in comments]
         results = []
-        for comment in comments:
-            score = self.analyze_text(comment.text)
+        for text, score in zip(texts, self.analyze_texts(texts)):
             results.append({
-                'text': comment.text,
+                'text': text,
                 'score': score,
                 'sentiment': 'positive' if score > 0 else 'negative' if score < 0 else 'neutral'
             })
@@ -59,16 +161,16 @@ class SentimentAnalyzer:
         
         return report 
 
-    def generate_report(self, comments):
-        total_comments = len(comments)
+    def generate_report(self, summary):
+        # summary - итоги из Database.get_sentiment_summary: счётчики тональности
+        # и несколько последних комментариев
+        positive, neutral, negative = summary['positive'], summary['neutral'], summary['negative']
+        last_comments = summary['last_comments']
+        total_comments = positive + neutral + negative
+
         if total_comments == 0:
             return "Нет комментариев для анализа"
-            
-        # Подсчет статистики
-        positive = sum(1 for c in comments if c.sentiment_score > 0)
-        negative = sum(1 for c in comments if c.sentiment_score < 0)
-        neutral = sum(1 for c in comments if c.sentiment_score == 0)
-        
+
         # Расчет процентов
         positive_pct = (positive / total_comments) * 100
         negative_pct = (negative / total_comments) * 100
@@ -87,8 +189,8 @@ class SentimentAnalyzer:
 """
         
         # Добавляем последние комментарии
-        for comment in comments[-5:]:  # Показываем последние 5 комментариев
-            sentiment_emoji = "😊" if comment.sentiment_score > 0 else "😐" if comment.sentiment_score == 0 else "😞"
-            report += f"\n{sentiment_emoji} {comment.text}"
+        for text, score in last_comments:  # Показываем последние 5 комментариев
+            sentiment_emoji = "😊" if score > 0 else "😐" if score == 0 else "😞"
+            report += f"\n{sentiment_emoji} {text}"
             
-        return report 
\ No newline at end of file
+        return report
\ No newline at end of file
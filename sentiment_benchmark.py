@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from sentiment_analyzer import SentimentAnalyzer, MODEL_NAME, BACKENDS
+
+# Образцы комментариев разной длины для замера пропускной способности
+SAMPLE_TEXTS = [
+    "Отличный пост, спасибо!",
+    "Ничего не понятно, зачем это вообще публиковать?",
+    "Интересно, а будет продолжение?",
+    "Ужасное качество, отписываюсь.",
+    "Согласен с автором, всё по делу.",
+    "Не знаю, у меня другой опыт: пробовали этот сервис в прошлом году, "
+    "поддержка отвечала неделями, а в итоге проблему так и не решили.",
+    "Лучший канал по теме, читаю каждый день и советую друзьям.",
+    "Цены опять выросли, это уже не смешно.",
+    "Ок",
+    "Подскажите, где можно посмотреть полную версию отчёта?",
+]
+
+
+# Размеченная выборка для проверки точности бэкендов относительно fp32 модели
+LABELLED_SAMPLE = [
+    ("Отличный пост, спасибо!", 'positive'),
+    ("Лучший канал по теме, читаю каждый день и советую друзьям.", 'positive'),
+    ("Очень полезная статья, всё понятно объяснили.", 'positive'),
+    ("Спасибо за подборку, сохранил себе.", 'positive'),
+    ("Прекрасная новость, ждём запуска!", 'positive'),
+    ("Класс, так держать!", 'positive'),
+    ("Ужасное качество, отписываюсь.", 'negative'),
+    ("Цены опять выросли, это уже не смешно.", 'negative'),
+    ("Поддержка не отвечает неделю, сервис отвратительный.", 'negative'),
+    ("Очередная реклама, надоело.", 'negative'),
+    ("Полная ерунда, автор не разбирается в теме.", 'negative'),
+    ("Разочарован, ожидал большего.", 'negative'),
+    ("Подскажите, где можно посмотреть полную версию отчёта?", 'neutral'),
+    ("Во сколько начинается трансляция?", 'neutral'),
+    ("Новая версия выйдет в следующем месяце.", 'neutral'),
+    ("Ссылка на документ в описании канала.", 'neutral'),
+    ("Встреча перенесена на четверг.", 'neutral'),
+    ("Есть ли доставка в другие города?", 'neutral'),
+]
+
+
+def _label(score):
+    return 'positive' if score > 0 else 'negative' if score < 0 else 'neutral'
+
+
+def _rss_mb():
+    # Текущий резидентный объём памяти процесса (Linux)
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def backend_report(backend, comments, batch_size):
+    # Замер одного бэкенда; запускается в отдельном процессе, чтобы память не смешивалась
+    rss_before = _rss_mb()
+    analyzer = SentimentAnalyzer(backend=backend, cascade=False)
+    started = time.perf_counter()
+    analyzer.warm_up()
+    load_seconds = time.perf_counter() - started
+
+    texts = [text for text, _ in LABELLED_SAMPLE]
+    scores = analyzer.analyze_texts(texts, batch_size=batch_size)
+
+    corpus = make_corpus(comments)
+    started = time.perf_counter()
+    analyzer.analyze_texts(corpus, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'backend': analyzer.backend,
+        'scores': scores,
+        'load_seconds': load_seconds,
+        'ms_per_comment': elapsed / len(corpus) * 1000,
+        'comments_per_sec': len(corpus) / elapsed,
+        'rss_mb': _rss_mb() - rss_before,
+    }
+
+
+def compare_backends(backends, comments, batch_size, threshold):
+    reports = {}
+    for backend in backends:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--backend-report', backend,
+             '--comments', str(comments), '--batch-size', str(batch_size)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        reports[backend] = json.loads(output.strip().splitlines()[-1])
+
+    reference = reports.get('pytorch') or next(iter(reports.values()))
+    reference_labels = [_label(score) for score in reference['scores']]
+    expected = [label for _, label in LABELLED_SAMPLE]
+
+    failures = []
+    print(f"{'backend':>10} {'accuracy':>9} {'parity':>7} {'max |Δ|':>8} {'ms/comment':>11} {'comments/sec':>13} {'RSS, MB':>8} {'load, s':>8}")
+    for backend, report in reports.items():
+        labels = [_label(score) for score in report['scores']]
+        accuracy = sum(a == b for a, b in zip(labels, expected)) / len(expected)
+        parity = sum(a == b for a, b in zip(labels, reference_labels)) / len(reference_labels)
+        max_diff = max(abs(a - b) for a, b in zip(report['scores'], reference['scores']))
+        print(f"{report['backend']:>10} {accuracy:>9.2f} {parity:>7.2f} {max_diff:>8.3f} "
+              f"{report['ms_per_comment']:>11.2f} {report['comments_per_sec']:>13.1f} "
+              f"{report['rss_mb']:>8.0f} {report['load_seconds']:>8.1f}")
+        if parity < threshold:
+            failures.append(f"{backend}: совпадение меток с fp32 {parity:.2f} ниже порога {threshold:.2f}")
+    return failures
+
+
+def make_corpus(size):
+    return [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] + f" #{i}" for i in range(size)]
+
+
+def run(analyzer, texts, batch_sizes, repeats):
+    reference = [analyzer.analyze_text(text) for text in texts]
+    rows = []
+    for batch_size in batch_sizes:
+        best = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            scores = analyzer.analyze_texts(texts, batch_size=batch_size)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        # Оценки пакетного режима должны совпадать с поштучным анализом
+        max_diff = max(abs(a - b) for a, b in zip(reference, scores))
+        rows.append((batch_size, len(texts) / best, max_diff))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f"Пропускная способность {MODEL_NAME} в зависимости от размера батча")
+    parser.add_argument('--comments', type=int, default=256)
+    parser.add_argument('--batch-sizes', default='1,4,8,16,32,64')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--backend', choices=BACKENDS, default=None)
+    parser.add_argument('--compare-backends', default=None,
+                        help="Сравнить бэкенды через запятую: точность, совпадение с fp32, задержка, память")
+    parser.add_argument('--parity-threshold', type=float, default=0.95)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--backend-report', choices=BACKENDS, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend_report:
+        print(json.dumps(backend_report(args.backend_report, args.comments, args.batch_size)))
+        sys.exit(0)
+
+    if args.compare_backends:
+        failures = compare_backends(args.compare_backends.split(','), args.comments, args.batch_size, args.parity_threshold)
+        for failure in failures:
+            print(f"Ошибка: {failure}")
+        sys.exit(1 if failures else 0)
+
+    # Замеряется сама модель, без каскада правил
+    analyzer = SentimentAnalyzer(backend=args.backend, cascade=False)
+    texts = make_corpus(args.comments)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+
+    print(f"{'batch':>6} {'comments/sec':>14} {'max |Δscore|':>14}")
+    for batch_size, throughput, max_diff in run(analyzer, texts, batch_sizes, args.repeats):
+        print(f"{batch_size:>6} {throughput:>14.1f} {max_diff:>14.2e}")
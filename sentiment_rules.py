@@ -0,0 +1,132 @@
+import re
+import threading
+from collections import Counter, OrderedDict
+from comment_scoring import normalize_text
+
+# Оценка, которую правила ставят уверенно размеченным текстам
+RULE_CONFIDENCE = 0.9
+
+POSITIVE_EMOJI = set('👍😊😀😃😄😁😆😂🤣😍🥰😘❤🧡💛💚💙💜♥🔥👏🙏💯✅🎉🤩😎🙌💪⭐🌟😉🙂☺😇🤗')
+NEGATIVE_EMOJI = set('👎😞😠😡🤬😢😭😒😔😕🙁☹😩😫💩🤮🤢😤😣😖❌🖕😱😨')
+NEUTRAL_EMOJI = set('🤔😐😶🙄👀🤷❓❔')
+
+POSITIVE_WORDS = {
+    '+', '+1', '++', 'спасибо', 'спс', 'благодарю', 'класс', 'классно', 'круто', 'супер',
+    'отлично', 'шикарно', 'огонь', 'топ', 'браво', 'молодцы', 'молодец', 'согласен',
+    'согласна', 'люблю', 'прекрасно', 'замечательно', 'здорово', 'красота', 'ура',
+}
+NEGATIVE_WORDS = {
+    '-', '-1', 'ужас', 'ужасно', 'отстой', 'фу', 'бред', 'позор', 'кошмар', 'отвратительно',
+    'плохо', 'фигня', 'ерунда', 'жесть', 'разочарован', 'разочарована', 'отписка', 'отписываюсь',
+}
+NEUTRAL_WORDS = {'ок', 'ok', 'окей', 'хм', 'ага', 'понятно', 'ясно', '?', '??', '...'}
+
+# Символы, не влияющие на тональность эмодзи-сообщений: модификаторы, ZWJ, пробелы
+_emoji_filler = re.compile('[\\s\\ufe0f\\u200d\\U0001F3FB-\\U0001F3FF]')
+_trailing_punctuation = re.compile(r'[!.,)]+$')
+
+
+class SentimentCascade:
+    # Дешёвый каскад перед моделью: пустые, эмодзи-only, однословные
+    # и уже встречавшиеся тексты размечаются без инференса
+    def __init__(self, memo_size=10000):
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = Counter()
+
+    def classify(self, text):
+        # Возвращает (стадия, оценка) или (None, None), если нужен инференс
+        normalized = normalize_text(text)
+        if not normalized:
+            return 'empty', 0.0
+
+        with self._lock:
+            if normalized in self._memo:
+                self._memo.move_to_end(normalized)
+                return 'repeat', self._memo[normalized]
+
+        symbols = _emoji_filler.sub('', normalized)
+        if symbols and all(ch in POSITIVE_EMOJI or ch in NEGATIVE_EMOJI or ch in NEUTRAL_EMOJI for ch in symbols):
+            positive = sum(ch in POSITIVE_EMOJI for ch in symbols)
+            negative = sum(ch in NEGATIVE_EMOJI for ch in symbols)
+            if positive and not negative:
+                return 'emoji', RULE_CONFIDENCE
+            if negative and not positive:
+                return 'emoji', -RULE_CONFIDENCE
+            if not positive and not negative:
+                return 'emoji', 0.0
+
+        if ' ' not in normalized:
+            word = _trailing_punctuation.sub('', normalized) or normalized
+            if word in POSITIVE_WORDS:
+                return 'lexicon', RULE_CONFIDENCE
+            if word in NEGATIVE_WORDS:
+                return 'lexicon', -RULE_CONFIDENCE
+            if word in NEUTRAL_WORDS:
+                return 'lexicon', 0.0
+
+        return None, None
+
+    def remember(self, text, score):
+        normalized = normalize_text(text)
+        with self._lock:
+            self._memo[normalized] = score
+            self._memo.move_to_end(normalized)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def split(self, texts):
+        # Делит тексты на размеченные правилами и требующие модели. Повторы
+        # внутри одной пачки отправляются в модель один раз
+        scores = {}
+        remaining = []
+        duplicates = {}
+        first_seen = {}
+        stages = Counter()
+        for i, text in enumerate(texts):
+            stage, score = self.classify(text)
+            if stage is not None:
+                scores[i] = score
+                stages[stage] += 1
+                continue
+            normalized = normalize_text(text)
+            if normalized in first_seen:
+                duplicates[i] = first_seen[normalized]
+                stages['repeat'] += 1
+            else:
+                first_seen[normalized] = i
+                remaining.append(i)
+        stages['model'] += len(remaining)
+        with self._lock:
+            self.hits.update(stages)
+        return scores, remaining, duplicates
+
+    def _merge(self, texts, scores, remaining, duplicates, model_scores):
+        for i, score in zip(remaining, model_scores):
+            scores[i] = score
+            self.remember(texts[i], score)
+        for i, first in duplicates.items():
+            scores[i] = scores[first]
+        return [scores[i] for i in range(len(texts))]
+
+    def run(self, texts, model):
+        # Прогоняет тексты через каскад; model(list) оценивает оставшиеся
+        scores, remaining, duplicates = self.split(texts)
+        model_scores = model([texts[i] for i in remaining]) if remaining else []
+        return self._merge(texts, scores, remaining, duplicates, model_scores)
+
+    async def run_async(self, texts, model):
+        scores, remaining, duplicates = self.split(texts)
+        model_scores = await model([texts[i] for i in remaining]) if remaining else []
+        return self._merge(texts, scores, remaining, duplicates, model_scores)
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.hits.values())
+            return {
+                'total': total,
+                'stages': dict(self.hits),
+                'hit_rates': {stage: count / total for stage, count in self.hits.items()} if total else {},
+                'skipped_inference': 1 - self.hits['model'] / total if total else 0.0,
+            }
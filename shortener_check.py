@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from aiohttp import web
+from async_database import AsyncDatabase
+from database import Database
+from link_shortener import LinkShortener
+
+
+class StandInShortener:
+    # Локальная замена Bitly и TinyURL: отвечает с заданной задержкой или ошибкой
+    def __init__(self):
+        self.delay = 0.0
+        self.status = 200
+        # Ответ Bitly не того формата: клиент получает непредвиденное исключение
+        self.malformed = False
+        self.requests = 0
+        self.tokens = set()
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api-create.php', self._tinyurl)
+        app.router.add_post('/v4/shorten', self._bitly)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    async def _reply(self, url):
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            raise web.HTTPServiceUnavailable()
+        return f"https://short.test/{abs(hash(url)) % 10 ** 8}"
+
+    async def _tinyurl(self, request):
+        return web.Response(text=await self._reply(request.query['url']))
+
+    async def _bitly(self, request):
+        self.tokens.add(request.headers.get('Authorization'))
+        payload = await request.json()
+        link = await self._reply(payload['long_url'])
+        return web.json_response([link] if self.malformed else {'link': link}, status=201)
+
+
+async def run_checks(urls_count):
+    failures = []
+
+    def check(condition, message):
+        print(f"{'OK' if condition else 'Ошибка'}: {message}")
+        if not condition:
+            failures.append(message)
+
+    stand_in = await StandInShortener().start()
+    with tempfile.TemporaryDirectory() as workdir:
+        db = AsyncDatabase(Database(url=f"sqlite:///{os.path.join(workdir, 'shortener.db')}"))
+        urls = [f"https://example.com/page/{i}" for i in range(urls_count)]
+
+        def make_shortener(**kwargs):
+            options = dict(provider='tinyurl', api_url=stand_in.url, timeout=0.5, batch_timeout=2,
+                           concurrency=10, failure_threshold=3, reset_timeout=1)
+            options.update(kwargs)
+            return LinkShortener(db, 'http://tracker.test', **options)
+
+        shortener = make_shortener()
+        try:
+            # Ссылки поста сокращаются одновременно через общий пул соединений
+            stand_in.delay = 0.2
+            started = time.perf_counter()
+            short_urls, short_ids = await shortener.shorten_many(urls)
+            elapsed = time.perf_counter() - started
+            check(all(short_urls[url].startswith('https://short.test/') for url in urls) and not short_ids,
+                  f"{urls_count} ссылок сокращены сервисом")
+            check(elapsed < urls_count * stand_in.delay / 2,
+                  f"пачка сокращена за {elapsed:.2f} с при {stand_in.delay} с на запрос")
+
+            # Повторные ссылки не уходят в сервис: из памяти процесса, затем из short_urls
+            requests = stand_in.requests
+            again, _ = await shortener.shorten_many(urls)
+            check(again == short_urls and stand_in.requests == requests, "повторная пачка взята из кэша в памяти")
+            restarted = make_shortener()
+            again, _ = await restarted.shorten_many(urls)
+            await restarted.close()
+            check(again == short_urls and stand_in.requests == requests, "после перезапуска пачка взята из short_urls")
+
+            # Медленный сервис: ссылки получают /track, цепь размыкается
+            stand_in.delay = 1.0
+            fresh = [f"https://example.com/slow/{i}" for i in range(urls_count)]
+            started = time.perf_counter()
+            short_urls, short_ids = await shortener.shorten_many(fresh, post_id=None)
+            elapsed = time.perf_counter() - started
+            check(set(short_ids) == set(fresh)
+                  and all(short_urls[url] == f"http://tracker.test/track/{short_ids[url]}" for url in fresh),
+                  f"при медленном сервисе ссылки заменены на /track за {elapsed:.2f} с")
+            check(shortener.breaker.state == 'open', "цепь разомкнута после ошибок")
+            requests = stand_in.requests
+            await shortener.shorten_many([f"https://example.com/open/{i}" for i in range(5)])
+            check(stand_in.requests == requests, "при разомкнутой цепи сервис не вызывается")
+
+            # После reset_timeout в сервис уходит один пробный URL пачки, успех замыкает цепь
+            stand_in.delay = 0.0
+            await asyncio.sleep(shortener.breaker.reset_timeout)
+            requests = stand_in.requests
+            recovered = [f"https://example.com/recovered/{i}" for i in range(5)]
+            short_urls, short_ids = await shortener.shorten_many(recovered)
+            check(stand_in.requests == requests + 1 and len(short_ids) == len(recovered) - 1
+                  and short_urls[recovered[0]].startswith('https://short.test/'),
+                  f"в полуоткрытой цепи сервис получил {stand_in.requests - requests} запрос(ов)")
+            check(shortener.breaker.state == 'closed', "цепь замкнута после восстановления сервиса")
+
+            # API Bitly: токен передаётся в заголовке
+            bitly = make_shortener(provider='bitly', token='check-token')
+            short_url = await bitly.shorten('https://example.com/bitly')
+            await bitly.close()
+            check(short_url.startswith('https://short.test/') and 'Bearer check-token' in stand_in.tokens,
+                  "ссылка сокращена через API Bitly")
+
+            # Непредвиденная ошибка разбора ответа: ссылки получают /track, ошибки учитываются цепью
+            stand_in.malformed = True
+            bitly = make_shortener(provider='bitly', token='check-token')
+            malformed = [f"https://example.com/malformed/{i}" for i in range(2)]
+            short_urls, short_ids = await bitly.shorten_many(malformed)
+            await bitly.close()
+            stand_in.malformed = False
+            check(set(short_ids) == set(malformed) and bitly.errors == len(malformed)
+                  and bitly.breaker.failures == len(malformed),
+                  "при некорректном ответе сервиса ссылки заменены на /track")
+            print(shortener.stats())
+        finally:
+            await shortener.close()
+            await stand_in.close()
+            db.close()
+            db.db.engine.dispose()
+            db.db.read_engine.dispose()
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Проверка LinkShortener на локальной замене сервиса сокращения')
+    parser.add_argument('--urls', type=int, default=20, help='ссылок в пачке')
+    args = parser.parse_args()
+    failures = asyncio.run(run_checks(args.urls))
+    sys.exit(1 if failures else 0)
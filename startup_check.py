@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Модули, которые не должны загружаться при старте бота и сервера ссылок
+HEAVY_MODULES = ('torch', 'transformers', 'pandas', 'matplotlib')
+STARTUP_MODULES = ('bot', 'webhook_server')
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'heavy': [name for name in {heavy!r} if name in sys.modules]
+}}))
+"""
+
+
+def measure_import(module):
+    repo = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = repo + os.pathsep + env.get('PYTHONPATH', '')
+    # bot.py завершается без этих переменных, реальные значения для импорта не нужны
+    env.setdefault('API_ID', '1')
+    env.setdefault('API_HASH', 'startup-check')
+    env.setdefault('BOT_TOKEN', 'startup-check')
+    # Импорт создаёт файлы базы и сессии, поэтому запускаем его во временной папке
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def check_startup(budget=None):
+    budget = budget or float(os.getenv('IMPORT_TIME_BUDGET', 3.0))
+    failures = []
+    for module in STARTUP_MODULES:
+        result = measure_import(module)
+        print(f"{module}: {result['seconds']:.2f} с, тяжёлые модули: {', '.join(result['heavy']) or 'нет'}")
+        if result['heavy']:
+            failures.append(f"{module} импортирует {', '.join(result['heavy'])} при старте")
+        if result['seconds'] > budget:
+            failures.append(f"{module} импортируется {result['seconds']:.2f} с при бюджете {budget:.2f} с")
+    return failures
+
+
+if __name__ == '__main__':
+    failures = check_startup()
+    for failure in failures:
+        print(f"Ошибка: {failure}")
+    sys.exit(1 if failures else 0)
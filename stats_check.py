@@ -0,0 +1,98 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from database import Database, StatsRollup, _link_statistics_query, _channel_link_totals_query, _channel_top_links_query
+from migrations import explain_query_plan
+
+# Проверка, что статистика ссылок поста и канала не зависит от объёма истории
+# других каналов: запросы ищут агрегаты по полному ключу ссылки, а время ответа
+# не растёт после добавления агрегатов постороннего канала
+
+
+def _timed(fn, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat
+
+
+def run_checks(rollups):
+    failures = []
+
+    def check(condition, message):
+        print(f"{'OK' if condition else 'Ошибка'}: {message}")
+        if not condition:
+            failures.append(message)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db = Database(url=f"sqlite:///{os.path.join(workdir, 'stats.db')}")
+        try:
+            channel = db.add_channel('-100100', 'Проверяемый канал', 'checked')
+            post_id = db.save_post('Пост со ссылкой', datetime.now(), channel, 1)
+            short_id = db.create_short_link(post_id, 'https://example.com/checked')
+            link_id = db.get_link_by_short_id(short_id)['link_id']
+            db.record_link_clicks([
+                {'link_id': link_id, 'user_agent': 'check', 'ip_address': f"10.0.0.{i}", 'referrer': 'Direct'}
+                for i in range(5)
+            ])
+
+            def link_statistics():
+                return db.get_link_statistics(post_id)
+
+            def channel_link_statistics():
+                return db.get_channel_link_statistics('-100100')
+
+            before_link, link_ms = _timed(link_statistics)
+            before_channel, channel_ms = _timed(channel_link_statistics)
+
+            # Агрегаты ссылок постороннего канала: id ссылок выше проверяемой
+            start = datetime.now() - timedelta(days=rollups)
+            with db.session_scope('stats_check') as session:
+                session.execute(insert(StatsRollup), [
+                    {'scope': 'link', 'scope_id': link_id + 1 + i % 1000, 'period': 'day',
+                     'bucket': start + timedelta(days=i // 1000), 'clicks': 1, 'unique_visitors': 1,
+                     'posts': 0, 'views': 0}
+                    for i in range(rollups)
+                ])
+
+            after_link, link_after_ms = _timed(link_statistics)
+            after_channel, channel_after_ms = _timed(channel_link_statistics)
+            check(after_link == before_link and after_link[0]['clicks'] == 5 and after_link[0]['unique_ips'] == 5,
+                  "статистика ссылок поста не изменилась")
+            check(after_channel == before_channel and after_channel['total_clicks'] == 5,
+                  "статистика ссылок канала не изменилась")
+
+            with db.read_engine.connect() as connection:
+                for name, statement in (
+                    ('link_statistics', _link_statistics_query(post_id)),
+                    ('channel_link_totals', _channel_link_totals_query(channel)),
+                    ('channel_top_links', _channel_top_links_query(channel)),
+                ):
+                    details = explain_query_plan(connection, statement)
+                    rollup_searches = [d for d in details if 'stats_rollups' in d]
+                    check(rollup_searches and all('scope=? AND scope_id=? AND period=?' in d for d in rollup_searches),
+                          f"{name}: агрегаты ищутся по ключу ссылки ({'; '.join(rollup_searches)})")
+
+            # Запас на разброс времени: без поиска по ключу запросы замедляются в десятки раз
+            check(link_after_ms < link_ms * 3 + 0.002,
+                  f"статистика ссылок поста: {link_ms * 1000:.1f} мс -> {link_after_ms * 1000:.1f} мс "
+                  f"после {rollups} агрегатов другого канала")
+            check(channel_after_ms < channel_ms * 3 + 0.002,
+                  f"статистика ссылок канала: {channel_ms * 1000:.1f} мс -> {channel_after_ms * 1000:.1f} мс "
+                  f"после {rollups} агрегатов другого канала")
+        finally:
+            db.engine.dispose()
+            db.read_engine.dispose()
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Проверка запросов статистики ссылок на большой истории других каналов')
+    parser.add_argument('--rollups', type=int, default=300000, help='агрегатов постороннего канала')
+    args = parser.parse_args()
+    failures = run_checks(args.rollups)
+    sys.exit(1 if failures else 0)
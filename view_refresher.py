@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+from datetime import timedelta
+from telethon.errors import ChannelPrivateError, FloodWaitError
+
+# Сколько id сообщений запрашивать за один вызов channels.getMessages
+# (messages.getMessagesViews ботам недоступен)
+VIEWS_REQUEST_SIZE = 100
+
+
+def parse_tiers(value):
+    # "1:600,7:3600,30:21600" -> посты моложе суток раз в 10 минут, моложе недели
+    # раз в час, моложе 30 дней раз в 6 часов; старше - не обновляются
+    tiers = []
+    for item in value.split(','):
+        days, seconds = item.split(':')
+        tiers.append((timedelta(days=float(days)), timedelta(seconds=float(seconds))))
+    return sorted(tiers)
+
+
+class ViewRefresher:
+    # Периодическое обновление просмотров постов активных каналов
+    def __init__(self, client, db, entities=None, interval=None, tiers=None, limit=None):
+        self.client = client
+        self.db = db
+        self.entities = entities
+        self.interval = interval or int(os.getenv('VIEWS_REFRESH_INTERVAL', 60))
+        self.tiers = tiers or parse_tiers(os.getenv('VIEWS_REFRESH_TIERS', '1:600,7:3600,30:21600'))
+        # Ограничение числа постов одного канала за цикл
+        self.limit = limit or int(os.getenv('VIEWS_REFRESH_LIMIT', 1000))
+        self._task = None
+        self.cycles = 0
+        self.last_cycle = {}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def refresh(self):
+        # Один цикл по всем активным каналам; возвращает сводку с задержками
+        started = time.perf_counter()
+        summary = {'channels': 0, 'posts': 0, 'requests': 0, 'errors': 0}
+        for channel in await self.db.get_active_channels():
+            try:
+                posts, requests = await self.refresh_channel(channel)
+            except FloodWaitError as e:
+                print(f"FloodWait {e.seconds} сек при обновлении просмотров, цикл прерван")
+                summary['errors'] += 1
+                await asyncio.sleep(e.seconds)
+                break
+            except Exception as e:
+                print(f"Ошибка при обновлении просмотров канала {channel.title}: {e}")
+                summary['errors'] += 1
+                continue
+            if posts:
+                summary['channels'] += 1
+                summary['posts'] += posts
+                summary['requests'] += requests
+        summary['seconds'] = time.perf_counter() - started
+        self.cycles += 1
+        self.last_cycle = summary
+        return summary
+
+    async def refresh_channel(self, channel):
+        posts = await self.db.get_posts_for_view_refresh(channel.id, self.tiers, limit=self.limit)
+        if not posts:
+            return 0, 0
+        if self.entities is not None:
+            peer = await self.entities.get_input_peer(channel.channel_id, channel.username)
+        else:
+            peer = channel.username
+        message_ids = [post.message_id for post in posts]
+        views = {}
+        requests = 0
+        for start in range(0, len(message_ids), VIEWS_REQUEST_SIZE):
+            chunk = message_ids[start:start + VIEWS_REQUEST_SIZE]
+            try:
+                messages = await self.client.get_messages(peer, ids=chunk)
+            except ChannelPrivateError:
+                if self.entities is not None:
+                    await self.entities.invalidate(channel.channel_id)
+                raise
+            requests += 1
+            # Сообщения возвращаются в порядке запрошенных id, удалённые - None
+            for message_id, message in zip(chunk, messages):
+                if message is not None and message.views is not None:
+                    views[message_id] = message.views
+        updated = await self.db.update_posts_views(channel.id, views)
+        return updated, requests
+
+    async def _run(self):
+        while True:
+            try:
+                summary = await self.refresh()
+                if summary['posts']:
+                    print(f"Обновлены просмотры {summary['posts']} постов в {summary['channels']} каналах "
+                          f"за {summary['seconds']:.2f} с ({summary['requests']} запросов)")
+            except Exception as e:
+                print(f"Ошибка при обновлении просмотров: {e}")
+            await asyncio.sleep(self.interval)
@@ -1,14 +1,44 @@
-from flask import Flask, request, redirect
+from flask import Flask, request, redirect, jsonify
 from database import Database
+from click_buffer import ClickBuffer
+from link_cache import LinkCache
 from datetime import datetime
+import atexit
+import signal
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = Flask(__name__)
+
+# Кэш short_id -> ссылка: ссылки не меняются после создания, а несуществующие
+# id запоминаются отдельно, чтобы перебор случайных id не доходил до SQLite.
+# Ссылки создаёт и удаляет бот в другом процессе, поэтому удалённая ссылка
+# отдаётся из кэша не дольше LINK_CACHE_TTL
+link_cache = LinkCache(
+    max_size=int(os.getenv('LINK_CACHE_SIZE', 100000)),
+    ttl=float(os.getenv('LINK_CACHE_TTL', 300)),
+    negative_ttl=float(os.getenv('LINK_CACHE_NEGATIVE_TTL', 60))
+)
 db = Database()
 
+# Режим записи кликов: sync - запись в обработчике запроса,
+# buffered - клики копятся в очереди и пишутся фоновым потоком пачками
+CLICK_INGESTION = os.getenv('CLICK_INGESTION', 'buffered')
+
+click_buffer = None
+if CLICK_INGESTION == 'buffered':
+    click_buffer = ClickBuffer(
+        db,
+        max_size=int(os.getenv('CLICK_QUEUE_SIZE', 10000)),
+        batch_size=int(os.getenv('CLICK_BATCH_SIZE', 500)),
+        flush_interval=float(os.getenv('CLICK_FLUSH_INTERVAL', 1.0)),
+        max_attempts=int(os.getenv('CLICK_FLUSH_ATTEMPTS', 5)),
+        dead_letter_path=os.getenv('CLICK_DEAD_LETTER_PATH', 'click_dead_letter.jsonl')
+    ).start()
+    atexit.register(click_buffer.close)
+
 @app.route('/track/<short_id>')
 def track_link(short_id):
     try:
@@ -16,28 +46,54 @@ def track_link(short_id):
         user_agent = request.headers.get('User-Agent', 'Unknown')
         ip_address = request.remote_addr
         referrer = request.headers.get('Referer', 'Direct')
-        
+
         # Получаем оригинальную ссылку из базы данных
-        link_data = db.get_link_by_short_id(short_id)
+        link_data = link_cache.resolve(short_id, db.get_link_by_short_id)
         if not link_data:
             return "Link not found", 404
-            
-        # Сохраняем информацию о клике
-        db.save_link_click(
-            original_url=link_data['original_url'],
-            short_url=f"/track/{short_id}",
-            post_id=link_data['post_id'],
-            user_agent=user_agent,
-            ip_address=ip_address,
-            referrer=referrer
-        )
-        
+
+        # Сохраняем информацию о клике по уже найденному link_id
+        click = {
+            'link_id': link_data['link_id'],
+            'user_agent': user_agent,
+            'ip_address': ip_address,
+            'referrer': referrer,
+            'click_time': datetime.now()
+        }
+        if click_buffer:
+            click_buffer.add(click)
+        else:
+            db.record_link_clicks([click])
+
         # Перенаправляем на оригинальную ссылку
         return redirect(link_data['original_url'])
     except Exception as e:
         print(f"Ошибка при обработке клика: {e}")
         return "Error", 500
 
+@app.route('/metrics/clicks')
+def click_metrics():
+    if not click_buffer:
+        return jsonify({'mode': CLICK_INGESTION})
+    return jsonify({'mode': CLICK_INGESTION, **click_buffer.stats()})
+
+@app.route('/metrics/links')
+def link_cache_metrics():
+    return jsonify(link_cache.stats())
+
+@app.route('/metrics/db')
+def db_pool_metrics():
+    return jsonify(db.get_pool_stats())
+
+@app.route('/metrics/memory')
+def memory_metrics():
+    return jsonify(db.get_memory_stats())
+
+def _handle_sigterm(signum, frame):
+    # SystemExit запускает atexit-обработчики, и очередь кликов дописывается в БД
+    raise SystemExit(0)
+
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, _handle_sigterm)
     port = int(os.getenv('WEBHOOK_PORT', 5000))
-    app.run(host='0.0.0.0', port=port) 
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port)